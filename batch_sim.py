@@ -0,0 +1,300 @@
+import pygame
+import numpy
+
+from consts import *
+
+from platforms import Platform, TiledImageStage
+from kill_area import KillArea
+from player import Player
+from inputs import LEFT, RIGHT, JUMP, JUMP_PRESS, JUMP_RELEASE, DASH, RESET
+
+
+# player constants that can be different for every player in a batch (eg for tuning sweeps)
+TUNABLE = ("x_accel", "x_accel_air_mod", "terminal_x_vel", "terminal_y_vel", "wall_slide_vel", "gravity", "jump_strength",
+           "coyote_time", "dash_strength", "dash_length", "dash_cooldown")
+
+
+class LevelOccupancy:
+    """which pixels of a level are solid, as a summed area table so whether a box has anything solid in it is 4 lookups
+
+    made from the platforms when it is built, so moving platforms are frozen where they were"""
+
+    def __init__(self, solid: numpy.ndarray, origin: tuple[int, int]):
+        self.origin = origin        # level coordinates of solid[0][0]
+        self.height, self.width = solid.shape
+        self.table = numpy.zeros((self.height + 1, self.width + 1), numpy.int32)
+        self.table[1:, 1:] = solid.cumsum(axis=0, dtype=numpy.int32).cumsum(axis=1, dtype=numpy.int32)
+
+    @classmethod
+    def from_platforms(cls, platforms: list[Platform]) -> "LevelOccupancy":
+        if not platforms:
+            return cls(numpy.zeros((1, 1), bool), (0, 0))
+        bounds = platforms[0].bounds.unionall([platform.bounds for platform in platforms[1:]])
+        solid = numpy.zeros((bounds.height, bounds.width), bool)
+        for platform in platforms:
+            if platform.has_rect:
+                rect = platform.rect.move(-bounds.x, -bounds.y)
+                solid[rect.top:rect.bottom, rect.left:rect.right] = True
+                continue
+            if isinstance(platform, TiledImageStage):
+                pixels = numpy.zeros(platform.image.get_size()[::-1], bool)
+                for y, start, end in platform.runs.tolist():
+                    pixels[y, start:end] = True
+            else:
+                surface = platform.mask.to_surface(setcolor=(255, 255, 255, 255), unsetcolor=(0, 0, 0, 255))
+                pixels = pygame.surfarray.array_red(surface).T > 0
+            x, y = int(platform.x_tl) - bounds.x, int(platform.y_tl) - bounds.y
+            solid[y:y + pixels.shape[0], x:x + pixels.shape[1]] |= pixels
+        return cls(solid, bounds.topleft)
+
+    def boxes_solid(self, x: numpy.ndarray, y: numpy.ndarray, width: int, height: int) -> numpy.ndarray:
+        """whether each width x height box with its top left at (x, y) (level coordinates) has anything solid in it"""
+        # same as pygame.Rect, positions are truncated towards 0
+        left = numpy.trunc(x).astype(numpy.int64) - self.origin[0]
+        top = numpy.trunc(y).astype(numpy.int64) - self.origin[1]
+        x0, x1 = numpy.clip(left, 0, self.width), numpy.clip(left + width, 0, self.width)
+        y0, y1 = numpy.clip(top, 0, self.height), numpy.clip(top + height, 0, self.height)
+        table = self.table
+        return (table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]) > 0
+
+
+class BatchPlayers:
+    """simulates count independent players in lockstep with numpy, following the same rules as Player.tick
+    (with swept_collision off) so thousands can be run at once for tuning and automated playtesting
+
+    every player gets its own inputs each step (see inputs.py) and constants listed in TUNABLE can be given as
+    arrays to give each player different values
+    portals and moving platforms aren't simulated"""
+
+    def __init__(self, count: int, occupancy: LevelOccupancy, kill_areas: list[KillArea] | None=None,
+                 spawn: tuple[float, float]=(100, 100), **constants):
+        self.count = count
+        self.occupancy = occupancy
+        self.spawn = spawn
+
+        defaults = Player(None)         # type: ignore      # for the default constants, it doesn't need a window
+        self.width, self.height = defaults.width, defaults.height
+        self.max_substep = defaults.max_substep
+        for name in TUNABLE:
+            value = constants.pop(name, getattr(defaults, name))
+            setattr(self, name, numpy.broadcast_to(numpy.asarray(value, float), (count,)).copy())
+        if constants:
+            raise TypeError(f"unknown player constants {', '.join(constants)}")
+
+        kill_rects = [kill_area.rect for kill_area in kill_areas or [] if kill_area.rect.width and kill_area.rect.height]
+        self.kill_rects = numpy.array([(rect.left, rect.top, rect.right, rect.bottom) for rect in kill_rects], numpy.int64).reshape(-1, 4)
+
+        self.x = numpy.zeros(count)
+        self.y = numpy.zeros(count)
+        self.x_vel = numpy.zeros(count)
+        self.y_vel = numpy.zeros(count)
+        self.time_since_dash = numpy.zeros(count)
+        self.time_since_jump = numpy.zeros(count)
+        self.time_since_touched_floor = numpy.zeros(count)
+        self.time_since_touched_wall = numpy.zeros(count)
+        self.wall_jump_dir = numpy.zeros(count)
+        self.wall_jumping = numpy.zeros(count, bool)
+        self.right = numpy.zeros(count, bool)
+        self.left = numpy.zeros(count, bool)
+        self.jumping = numpy.zeros(count, bool)
+        self.deaths = numpy.zeros(count, numpy.int64)
+        self.reset()
+
+    def reset(self, which: numpy.ndarray | None=None):
+        if which is None:
+            which = numpy.ones(self.count, bool)
+        self.x[which], self.y[which] = self.spawn
+        self.x_vel[which] = 0
+        self.y_vel[which] = 0
+        self.right[which] = self.left[which] = self.jumping[which] = False
+        self.time_since_dash[which] = 0
+        self.time_since_jump[which] = 0
+        self.time_since_touched_floor[which] = self.coyote_time[which]
+        self.time_since_touched_wall[which] = self.coyote_time[which]
+        self.wall_jump_dir[which] = 0
+        self.wall_jumping[which] = False
+
+    def touching(self, x: numpy.ndarray, y: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        # (in a kill area, overlapping a platform) for every player if they were at (x, y)
+        solid = self.occupancy.boxes_solid(x, y, self.width, self.height)
+        if len(self.kill_rects) == 0:
+            return numpy.zeros(self.count, bool), solid
+        left = numpy.trunc(x).astype(numpy.int64)[:, None]
+        top = numpy.trunc(y).astype(numpy.int64)[:, None]
+        kill = self.kill_rects
+        dead = ((left < kill[:, 2]) & (left + self.width > kill[:, 0]) & (top < kill[:, 3]) & (top + self.height > kill[:, 1])).any(axis=1)
+        return dead, solid
+
+    def blocked(self, x: numpy.ndarray, y: numpy.ndarray) -> numpy.ndarray:
+        # same as Player.touching(...) != -1
+        dead, solid = self.touching(x, y)
+        return dead | solid
+
+    def jump(self, which: numpy.ndarray, wall_jump: bool=False, auto: bool=False):
+        can_jump = self.time_since_touched_floor < self.coyote_time
+        if auto:
+            normal = which & can_jump & (self.time_since_jump > 0.2)
+        else:
+            normal = which & can_jump
+        self.y_vel[normal] = -self.jump_strength[normal]
+        self.time_since_touched_floor[normal] += self.coyote_time[normal]
+        jumped = normal
+
+        if wall_jump:
+            wall = which & ~normal & (self.time_since_touched_wall < self.coyote_time)
+            self.y_vel[wall] = -self.jump_strength[wall] * 0.7
+            self.time_since_touched_floor[wall] += self.coyote_time[wall]
+            self.x_vel[wall] = self.wall_jump_dir[wall] * 500
+            self.wall_jumping[wall] = True
+            jumped = jumped | wall
+        self.time_since_jump[jumped] = 0
+
+    def stop_jump(self, which: numpy.ndarray):
+        stop = which & (self.y_vel < 0) & ~self.wall_jumping
+        self.y_vel[stop] = 0
+
+    def dash(self, which: numpy.ndarray):
+        ready = which & (self.time_since_dash > self.dash_cooldown)
+        sign = numpy.where(self.left & ~self.right, -1.0,
+                           numpy.where(~self.left & self.right, 1.0,
+                                       numpy.where(self.x_vel > 0, 1.0, numpy.where(self.x_vel < 0, -1.0, 0.0))))
+        dashes = ready & (sign != 0)
+        self.x_vel[dashes] = self.dash_strength[dashes] * sign[dashes]
+        self.time_since_dash[dashes] = 0
+
+    def apply_input(self, bits: numpy.ndarray):
+        # same order as Game.apply_input
+        self.reset(bits & RESET != 0)
+        self.jump(bits & JUMP_PRESS != 0, wall_jump=True)
+        self.stop_jump(bits & JUMP_RELEASE != 0)
+        self.dash(bits & DASH != 0)
+        self.right = bits & RIGHT != 0
+        self.left = bits & LEFT != 0
+        self.jumping = bits & JUMP != 0
+
+    def unstick(self):
+        # try to get players out of an object (up to 6 pixels up then down), otherwise kill them
+        safe = numpy.zeros(self.count, bool)
+        for direction, start in ((-1, numpy.ones(self.count, bool)), (1, None)):
+            if start is None:
+                start = ~safe
+                self.y[start] += 6
+            active = start
+            for _ in range(6):
+                if not active.any():
+                    break
+                free = ~self.blocked(self.x, self.y)
+                safe |= active & free
+                self.y[active & ~free] += direction
+                active = active & ~free
+        return ~safe
+
+    def update_velocity(self, dt: float):
+        can_jump = self.time_since_touched_floor < self.coyote_time
+        x_accel = numpy.where(can_jump, self.x_accel, self.x_accel * self.x_accel_air_mod)
+        dashing = self.time_since_dash < self.dash_length
+        in_air = self.time_since_touched_floor > 0.1
+        max_speed = numpy.where(dashing, self.dash_strength,
+                                numpy.where((self.time_since_dash < self.dash_length + 0.1) & in_air, self.dash_strength / 3,
+                                            numpy.where(in_air, numpy.maximum(self.terminal_x_vel, numpy.abs(self.x_vel)),
+                                                        numpy.maximum(self.terminal_x_vel, numpy.abs(self.x_vel) * 0.9))))
+
+        x_vel = self.x_vel
+        neither = ~dashing & (self.right == self.left)
+        right = ~dashing & self.right & ~self.left
+        left = ~dashing & self.left & ~self.right
+        new_x_vel = x_vel.copy()
+        # slow to a halt if nothing (or both) is pressed
+        new_x_vel = numpy.where(neither & (x_vel < 0), numpy.minimum(x_vel + (x_accel * dt), 0), new_x_vel)
+        new_x_vel = numpy.where(neither & (x_vel > 0), numpy.maximum(x_vel - (x_accel * dt), 0), new_x_vel)
+        # twice the acceleration when slowing down
+        new_x_vel = numpy.where(right & (x_vel < 0), numpy.minimum(x_vel + (x_accel * 2 * dt), max_speed), new_x_vel)
+        new_x_vel = numpy.where(right & (x_vel >= 0), numpy.minimum(x_vel + (x_accel * dt), max_speed), new_x_vel)
+        new_x_vel = numpy.where(left & (x_vel > 0), numpy.maximum(x_vel - (x_accel * 2 * dt), -max_speed), new_x_vel)
+        new_x_vel = numpy.where(left & (x_vel <= 0), numpy.maximum(x_vel - (x_accel * dt), -max_speed), new_x_vel)
+        # terminal x vel
+        new_x_vel = numpy.where(~dashing & (new_x_vel < 0), numpy.maximum(new_x_vel, -max_speed), new_x_vel)
+        new_x_vel = numpy.where(~dashing & (new_x_vel > 0), numpy.minimum(new_x_vel, max_speed), new_x_vel)
+        self.x_vel = new_x_vel
+
+        self.time_since_touched_floor += dt
+        self.time_since_touched_wall += dt
+        self.time_since_dash += dt
+        self.time_since_jump += dt
+
+        falling = self.y_vel >= 0
+        gravity = numpy.where(falling, self.gravity * 2, self.gravity)
+        self.wall_jumping &= ~falling
+        self.y_vel = numpy.minimum(self.y_vel + (gravity * dt), self.terminal_y_vel)
+
+        self.jump(self.jumping, auto=True)
+
+        dashing = self.time_since_dash < self.dash_length
+        self.y_vel = numpy.where(dashing, numpy.minimum(0, self.y_vel), self.y_vel)
+
+    def update_position(self, dt: float) -> numpy.ndarray:
+        # same as Player.update_position_divided, returns which players died
+        distance = numpy.maximum(numpy.abs(self.x_vel), numpy.abs(self.y_vel)) * dt
+        divide = numpy.minimum(16, numpy.maximum(2, numpy.ceil(distance / self.max_substep))).astype(numpy.int64)
+        change_x = numpy.ones(self.count, bool)
+        change_y = numpy.ones(self.count, bool)
+        dead = numpy.zeros(self.count, bool)
+
+        for substep in range(int(divide.max())):
+            active = (substep < divide) & ~dead
+
+            moving = change_x & active
+            if moving.any():
+                step = (self.x_vel * dt) / divide
+                self.x = numpy.where(moving, self.x + step, self.x)
+                killed, solid = self.touching(self.x, self.y)
+                dead |= moving & killed
+                hit = moving & ~killed & solid
+                if hit.any():
+                    # moving up slopes
+                    slope = numpy.zeros(self.count, bool)
+                    can_climb = (numpy.abs(self.y_vel) <= 1) | (self.x_vel >= self.terminal_x_vel)
+                    for i in range(6):
+                        raised = numpy.where(hit, self.y - i, self.y)
+                        climbed = hit & ~slope & can_climb & ~self.blocked(self.x, raised)
+                        self.y = numpy.where(climbed, raised, numpy.where(hit, raised + i, self.y))
+                        slope |= climbed
+
+                    wall = hit & ~slope
+                    self.x = numpy.where(wall, self.x - step, self.x)
+                    self.hit_wall(wall)
+                    change_x &= ~wall
+
+            moving = change_y & active & ~dead
+            if moving.any():
+                step = (self.y_vel * dt) / divide
+                self.y = numpy.where(moving, self.y + step, self.y)
+                killed, solid = self.touching(self.x, self.y)
+                dead |= moving & killed
+                hit = moving & ~killed & solid
+                self.y = numpy.where(hit, self.y - step, self.y)
+                self.time_since_touched_floor[hit & (self.y_vel > 0)] = 0     # if floor is hit, touched_floor is now 0
+                self.y_vel[hit] = 0
+                change_y &= ~hit
+        return dead
+
+    def hit_wall(self, which: numpy.ndarray):
+        self.wall_jump_dir[which] = -numpy.sign(self.x_vel[which])
+        self.time_since_touched_wall[which] = 0
+        self.x_vel[which] = 0
+        stop_dash = which & (self.time_since_dash < self.dash_length)
+        self.time_since_dash[stop_dash] = self.dash_length[stop_dash]       # if wall is hit, stop dashing
+        self.y_vel[which] = numpy.minimum(self.y_vel[which], self.wall_slide_vel[which])      # slide down walls
+
+    def step(self, bits: numpy.ndarray, dt: float=PHYSICS_DT):
+        """advances every player by one tick, bits is an array of input flags (one per player)"""
+        self.apply_input(numpy.asarray(bits))
+
+        stuck = self.unstick()
+        self.deaths[stuck] += 1
+        self.reset(stuck)
+
+        self.update_velocity(dt)
+        dead = self.update_position(dt)
+        self.deaths[dead] += 1
+        self.reset(dead)
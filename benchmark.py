@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import platform as system
+import random
+import time
+import tracemalloc
+
+import pygame
+
+from consts import *
+
+from game import Game
+from platforms import Platform, Circle
+from kill_area import KillArea
+from portal import Portal
+from inputs import ScriptedInput
+from profiler import AllocationCounter, patch_methods, unpatch_methods, counted
+
+try:
+    import resource
+except ImportError:     # resource only exists on unix, peak python memory is still measured with tracemalloc
+    resource = None
+
+
+# runs around, jumps, dashes and wall jumps in both directions so most of the collision code gets used
+DEFAULT_SCRIPT = ("right*240 right+jump*60 right*120 dash right*120 jump*30 right+jump*240 idle*60 left*240 left+jump*120 "
+                  "dash left*120 right+jump*60 left+jump*60 right+jump*60 idle*120 left*480 right*480")
+
+DRAW_EVERY = PHYSICS_HZ // 60       # draw a frame every this many ticks (60 fps)
+
+
+def empty_level(game: Game):
+    game.clear_platforms()
+
+
+def many_platforms(game: Game, count: int=2000):
+    # a floor plus lots of small platforms scattered over a big area
+    rng = random.Random(0)
+    empty_level(game)
+    game.add_platform(Platform((-1000, 600), (12000, 100), game.win))
+    for _ in range(count):
+        x, y = rng.randrange(-1000, 11000), rng.randrange(-3000, 560)
+        if 0 < x < 400 and y > 0:
+            continue        # keep the spawn clear
+        game.add_platform(Platform((x, y), (rng.randrange(20, 120), rng.randrange(10, 40)), game.win))
+
+
+def many_circles(game: Game, count: int=300):
+    rng = random.Random(0)
+    empty_level(game)
+    game.add_platform(Platform((-1000, 600), (12000, 100), game.win))
+    for _ in range(count):
+        x, y = rng.randrange(-1000, 11000), rng.randrange(-3000, 540)
+        if 0 < x < 400 and y > 0:
+            continue
+        game.add_platform(Circle((x, y), rng.randrange(10, 60), game.win))
+
+
+def moving_platforms(game: Game, count: int=500):
+    rng = random.Random(0)
+    empty_level(game)
+    game.add_platform(Platform((-1000, 600), (12000, 100), game.win))
+    for _ in range(count):
+        x, y = rng.randrange(-1000, 11000), rng.randrange(-3000, 500)
+        if 0 < x < 500 and y > -100:
+            continue
+        speed = rng.randrange(20, 100)
+        vel_path = [((speed, 0), 2), ((0, -speed), 1), ((-speed, 0), 2), ((0, speed), 1)]
+        game.add_platform(Platform((x, y), (rng.randrange(40, 160), 20), game.win, vel_path))
+
+
+def many_hazards(game: Game, count: int=1000):
+    # a floor with lots of kill areas above it, some moving, and a few portals
+    rng = random.Random(0)
+    empty_level(game)
+    game.add_platform(Platform((-1000, 600), (12000, 100), game.win))
+    for _ in range(count):
+        x, y = rng.randrange(-1000, 11000), rng.randrange(-3000, 200)
+        game.add_trigger(KillArea((x, y), (rng.randrange(10, 60), rng.randrange(10, 60)), game.win, moving=rng.random() < 0.1))
+    for _ in range(10):
+        game.add_trigger(Portal((rng.randrange(1000, 11000), 480), (rng.randrange(1000, 11000), 480), (20, 100), game.win))
+
+
+SYNTHETIC_LEVELS = {"synthetic/platforms": many_platforms, "synthetic/circles": many_circles, "synthetic/moving": moving_platforms,
+                    "synthetic/hazards": many_hazards}
+
+
+def count_probes():
+    """wraps collide_rect and sweep on every platform class so calls to them are counted
+    returns the counts and a function that puts the original methods back"""
+    counts = {"probes": 0}
+    patched = patch_methods(Platform, ("collide_rect", "sweep", "clear_tops"), counted(counts, "probes"))
+    return counts, lambda: unpatch_methods(patched)
+
+
+def run_scenario(name: str, setup, script: ScriptedInput) -> dict:
+    """loads a level (setup(game) makes it) then runs the script four times: once timing the physics, once drawing
+    frames along the way, once counting collision probes and memory and once counting Rects and Masks made
+    (counting slows it down too much to time)"""
+    game = Game(name if setup is None else "", headless=True)
+    if setup is not None:
+        setup(game)
+    start_state = game.snapshot()
+
+    def restart():
+        # same start every time so the runs match
+        game.restore(start_state)
+        script.rewind()
+
+    ticks = len(script)
+
+    restart()
+    start = time.perf_counter()
+    game.simulate(script)
+    physics_seconds = time.perf_counter() - start
+    result = {
+        "level": name,
+        "platforms": len(game.platforms),
+        "ticks": ticks,
+        "ticks_per_second": ticks / physics_seconds if physics_seconds else 0.0,
+        "final_position": [game.player.x, game.player.y],
+        "deaths": game.player.deaths,
+    }
+
+    restart()
+    draw_seconds = 0.0
+    frames = 0
+    for tick in range(ticks):
+        game.step(script.next(), PHYSICS_DT)
+        if tick % DRAW_EVERY == 0:
+            start = time.perf_counter()
+            game.draw()
+            draw_seconds += time.perf_counter() - start
+            frames += 1
+    result["draw_ms_per_frame"] = draw_seconds / frames * 1000 if frames else 0.0
+    # pixels live in SDL's memory which tracemalloc doesn't see, so the surfaces the caches held at most are added up here
+    result["peak_tile_bytes"] = game.tile_cache.peak_size
+    result["peak_static_layer_bytes"] = game.static_layer.cache.peak_size
+
+    restart()
+    counts, restore = count_probes()
+    tracemalloc.start()
+    try:
+        game.simulate(script)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        restore()
+    result["probes_per_tick"] = counts["probes"] / ticks if ticks else 0.0
+    result["peak_python_heap_bytes"] = peak      # python objects only, not surface pixels or masks
+
+    restart()
+    allocations = AllocationCounter()
+    allocations.start()
+    try:
+        game.simulate(script)
+    finally:
+        allocations.stop()
+    result["allocations_per_tick"] = allocations.count / ticks if ticks else 0.0
+    return result
+
+
+def compare(results: list[dict], baseline_path: str):
+    # prints how much each level's numbers changed since a previous run
+    with open(baseline_path) as file:
+        baseline = {result["level"]: result for result in json.load(file)["results"]}
+    for result in results:
+        old = baseline.get(result["level"])
+        if old is None:
+            continue
+        changes = []
+        for key in ("ticks_per_second", "draw_ms_per_frame", "probes_per_tick", "peak_python_heap_bytes", "peak_tile_bytes",
+                    "peak_static_layer_bytes", "allocations_per_tick"):
+            if old.get(key):
+                changes.append(f"{key} {(result[key] / old[key] - 1) * 100:+.1f}%")
+        print(f"{result['level']}: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time physics, drawing and collisions on every level and some stress test levels")
+    parser.add_argument("--levels", nargs="*", help="only run these levels (eg levels/2 synthetic/circles)")
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="inputs to run on every level, see inputs.ScriptedInput")
+    parser.add_argument("--output", help="write the results to this json file instead of printing them")
+    parser.add_argument("--compare", help="json file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    levels = {f"levels/{folder}": None for folder in sorted(os.listdir("levels")) if os.path.isdir(f"levels/{folder}")}
+    levels.update(SYNTHETIC_LEVELS)
+    if args.levels:
+        levels = {name: levels.get(name) for name in args.levels}
+
+    script = ScriptedInput.parse(args.script)
+    results = []
+    for name, setup in levels.items():
+        results.append(run_scenario(name, setup, script))
+
+    report = {
+        "python": system.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": system.machine(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "script": args.script,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import pygame
+
+
+class SpatialGrid:
+    """uniform grid broadphase, maps each object to the cells its bounds cover so only nearby objects get tested"""
+
+    def __init__(self, cell_size: int=256):
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int], list] = {}
+        self.object_cells: dict[int, list[tuple[int, int]]] = {}     # id(obj) -> cells it is in
+        self.order: dict[int, int] = {}                              # id(obj) -> insertion order, keeps queries deterministic
+        self.next_order = 0
+
+    def __len__(self):
+        return len(self.object_cells)
+
+    def __contains__(self, obj):
+        return id(obj) in self.object_cells
+
+    def cells_for(self, rect: pygame.rect.Rect) -> list[tuple[int, int]]:
+        size = self.cell_size
+        # right and bottom edges are exclusive
+        x_start, x_end = rect.left // size, (rect.right - 1) // size
+        y_start, y_end = rect.top // size, (rect.bottom - 1) // size
+        return [(cx, cy) for cx in range(x_start, x_end + 1) for cy in range(y_start, y_end + 1)]
+
+    def insert(self, obj, rect: pygame.rect.Rect | None=None):
+        if rect is None:
+            rect = obj.bounds
+        if id(obj) in self.object_cells:
+            self.update(obj, rect)
+            return
+        cells = self.cells_for(rect)
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(obj)
+        self.object_cells[id(obj)] = cells
+        self.order[id(obj)] = self.next_order
+        self.next_order += 1
+
+    def remove(self, obj):
+        cells = self.object_cells.pop(id(obj), None)
+        if cells is None:
+            return
+        del self.order[id(obj)]
+        for cell in cells:
+            bucket = self.cells[cell]
+            bucket.remove(obj)
+            if not bucket:
+                del self.cells[cell]
+
+    def update(self, obj, rect: pygame.rect.Rect | None=None):
+        # move an object that is already in the grid, only touches the cells that changed
+        if rect is None:
+            rect = obj.bounds
+        old_cells = self.object_cells.get(id(obj))
+        if old_cells is None:
+            self.insert(obj, rect)
+            return
+        size = self.cell_size
+        if (old_cells and old_cells[0] == (rect.left // size, rect.top // size)
+                and old_cells[-1] == ((rect.right - 1) // size, (rect.bottom - 1) // size)):
+            return      # still covers the same cells (the usual case for moving platforms)
+        new_cells = self.cells_for(rect)
+        old_set, new_set = set(old_cells), set(new_cells)
+        for cell in old_set - new_set:
+            bucket = self.cells[cell]
+            bucket.remove(obj)
+            if not bucket:
+                del self.cells[cell]
+        for cell in new_set - old_set:
+            self.cells.setdefault(cell, []).append(obj)
+        self.object_cells[id(obj)] = new_cells
+
+    def query(self, rect: pygame.rect.Rect) -> list:
+        """returns every object in the cells rect covers, in the order they were inserted"""
+        size = self.cell_size
+        x_start, x_end = rect.left // size, (rect.right - 1) // size
+        y_start, y_end = rect.top // size, (rect.bottom - 1) // size
+        cells = self.cells
+
+        order = self.order
+        if x_start == x_end and y_start == y_end:
+            # most queries (the player) fit in a single cell
+            bucket = cells.get((x_start, y_start))
+            if not bucket:
+                return []
+            if len(bucket) == 1:
+                return list(bucket)
+            return sorted(bucket, key=lambda obj: order[id(obj)])
+
+        found = {}
+        for cx in range(x_start, x_end + 1):
+            for cy in range(y_start, y_end + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    for obj in bucket:
+                        found[id(obj)] = obj
+        if len(found) < 2:
+            return list(found.values())
+        return sorted(found.values(), key=lambda obj: order[id(obj)])
+
+    def clear(self):
+        self.cells.clear()
+        self.object_cells.clear()
+        self.order.clear()
@@ -0,0 +1,259 @@
+import pygame
+import numpy
+
+
+BLOCK_SIZE = 8      # masks are split into blocks this big, fully solid blocks are merged into rectangles
+PYRAMID_BLOCKS = (128, 32, 8)       # block sizes of the occupancy pyramid, coarsest first (each a multiple of the next)
+MAX_HEADROOM = 255                  # headroom maps are bytes, taller rects are tested with the mask instead
+HEADROOM_BAND = 128                 # headroom maps are worked out this many columns at a time, when they are first needed
+
+# what a block of the occupancy pyramid (or an area of a mask) contains
+EMPTY = 0
+MIXED = 1
+FULL = 2
+
+filled_masks: dict[tuple[int, int], pygame.mask.Mask] = {}
+
+
+def filled_mask(size: tuple[int, int]) -> pygame.mask.Mask:
+    # completely solid mask of this size, shared so the player's mask isn't remade for every collision test
+    # (don't draw on it)
+    mask = filled_masks.get(size)
+    if mask is None:
+        mask = filled_masks[size] = pygame.mask.Mask(size, True)
+    return mask
+
+
+class CachedRect:
+    """a Rect that is only updated (in place) when the position or size it is made from changes,
+    so reading an object's rect doesn't make a new one every time
+
+    the same Rect is returned every time, copy it before changing or keeping it"""
+
+    __slots__ = ("rect", "x", "y", "width", "height")
+
+    def __init__(self):
+        self.rect = pygame.rect.Rect(0, 0, 0, 0)
+        self.x = self.y = self.width = self.height = None
+
+    def get(self, x: float, y: float, width: float, height: float) -> pygame.rect.Rect:
+        if x != self.x or y != self.y or width != self.width or height != self.height:
+            self.rect.update(x, y, width, height)       # truncates like the Rect constructor does
+            self.x = x
+            self.y = y
+            self.width = width
+            self.height = height
+        return self.rect
+
+
+def sweep_area(rect: pygame.rect.Rect, distance: int, vertical: bool, out: pygame.rect.Rect) -> pygame.rect.Rect:
+    # the area rect covers moving distance pixels along one axis, written into out (and returned) instead of a new rect
+    out.update(rect)
+    if vertical:
+        out.height += abs(distance)
+        if distance < 0:
+            out.y += distance
+    else:
+        out.width += abs(distance)
+        if distance < 0:
+            out.x += distance
+    return out
+
+
+def solid_rects(solid: numpy.ndarray, block_size: int=BLOCK_SIZE) -> numpy.ndarray:
+    """splits the fully solid blocks of solid (a bool array indexed [y][x]) into a few merged rectangles
+    returns rows of (x, y, width, height), anything not covered is left for the exact mask test"""
+    height, width = solid.shape
+    rows, columns = height // block_size, width // block_size
+    if rows == 0 or columns == 0:
+        return numpy.zeros((0, 4), numpy.int32)
+    blocks = solid[:rows * block_size, :columns * block_size].reshape(rows, block_size, columns, block_size).all(axis=(1, 3))
+
+    # runs of full blocks along each row of blocks
+    padded = numpy.zeros((rows, columns + 2), numpy.int8)
+    padded[:, 1:-1] = blocks
+    edges = numpy.diff(padded, axis=1)
+    ys, starts = numpy.nonzero(edges > 0)
+    _, ends = numpy.nonzero(edges < 0)
+
+    # merge runs with the same start and end in the rows below them into one rect
+    rects = []
+    open_rects: dict[tuple[int, int], list[int]] = {}       # (start, end) -> [start, top row, end, bottom row]
+    current_row = -1
+    for y, start, end in zip(ys.tolist(), starts.tolist(), ends.tolist()):
+        if y != current_row:
+            # close rects that didn't continue into this row
+            for key in [key for key, rect in open_rects.items() if rect[3] < y]:
+                rects.append(open_rects.pop(key))
+            current_row = y
+        rect = open_rects.get((start, end))
+        if rect is not None and rect[3] == y:
+            rect[3] = y + 1
+        else:
+            if rect is not None:
+                rects.append(rect)
+            open_rects[(start, end)] = [start, y, end, y + 1]
+    rects.extend(open_rects.values())
+
+    result = numpy.array([(start * block_size, top * block_size, (end - start) * block_size, (bottom - top) * block_size)
+                          for start, top, end, bottom in rects], numpy.int32)
+    return result.reshape(-1, 4)
+
+
+def block_counts(runs: numpy.ndarray, size: tuple[int, int], block_size: int) -> numpy.ndarray:
+    """solid pixels in each block_size square block of a mask, from its runs (see level_cache.mask_runs)
+    indexed [block y][block x], blocks on the right and bottom edges are cut short by the edge of the mask"""
+    width, height = size
+    rows, columns = -(-height // block_size), -(-width // block_size)
+    # +1 where a run starts and -1 where it ends, summed along x this is how many rows of each block row are solid at each x
+    changes = numpy.zeros((rows, columns * block_size + 1), numpy.int32)
+    if len(runs):
+        numpy.add.at(changes, (runs[:, 0] // block_size, runs[:, 1]), 1)
+        numpy.add.at(changes, (runs[:, 0] // block_size, runs[:, 2]), -1)
+    column_counts = numpy.cumsum(changes[:, :-1], axis=1)
+    return column_counts.reshape(rows, columns, block_size).sum(axis=2)
+
+
+def blocks_mask(blocks: numpy.ndarray) -> pygame.mask.Mask:
+    # mask with a pixel for each block, set where blocks (a bool array indexed [y][x]) is
+    surface = pygame.surfarray.make_surface(blocks.T.astype(numpy.uint8))
+    surface.set_colorkey(0)
+    return pygame.mask.from_surface(surface)
+
+
+def headroom_map(runs: numpy.ndarray, height: int, left: int, right: int) -> numpy.ndarray:
+    """for every pixel in columns left to right of a mask, how many pixels there are from it up to the first solid pixel
+    above it in its column (0 if it is solid, MAX_HEADROOM if there isn't one that close), indexed [y][x - left]
+    a rect whose bottom row is y fits in a column if the headroom there is at least the rect's height"""
+    width = right - left
+    starts = numpy.clip(runs[:, 1] - left, 0, width)
+    ends = numpy.clip(runs[:, 2] - left, 0, width)
+    keep = ends > starts
+    # runs in a row never start or end on the same pixel so the starts and ends can just be set
+    changes = numpy.zeros((height, width + 1), numpy.int8)
+    changes[runs[keep, 0], starts[keep]] = 1
+    changes[runs[keep, 0], ends[keep]] = -1
+    solid = numpy.cumsum(changes[:, :-1], axis=1, dtype=numpy.int8).astype(bool)
+    rows = numpy.arange(height, dtype=numpy.int32)[:, None]
+    # the last solid row at or above each pixel, going down the columns
+    last_solid = numpy.where(solid, rows, numpy.int32(-MAX_HEADROOM - 1))
+    numpy.maximum.accumulate(last_solid, axis=0, out=last_solid)
+    return numpy.minimum(rows - last_solid, MAX_HEADROOM).astype(numpy.uint8)
+
+
+class OccupancyPyramid:
+    """a mask split into blocks at a few sizes, each block marked EMPTY, FULL or MIXED
+
+    whether an area is empty or solid can usually be told from a few blocks, starting with the biggest ones and only
+    going down to smaller blocks where they are mixed, the pixels only need testing if the smallest blocks are mixed
+    each level is kept as small masks with a pixel per block (blocks with anything solid, full blocks and blocks that
+    aren't full) so looking at all the blocks under an area is a mask overlap"""
+
+    __slots__ = ("rect", "levels")
+
+    def __init__(self, runs: numpy.ndarray, size: tuple[int, int], block_sizes: tuple[int, ...]=PYRAMID_BLOCKS):
+        width, height = size
+        self.rect = pygame.rect.Rect((0, 0), size)
+        self.levels: list[tuple[int, pygame.mask.Mask, pygame.mask.Mask, pygame.mask.Mask]] = []     # (block size, non empty blocks, full blocks, not full blocks), coarsest first
+        finest = block_sizes[-1]
+        counts = block_counts(runs, size, finest)
+        for block_size in block_sizes:
+            # add up the smallest blocks into bigger ones
+            factor = block_size // finest
+            rows, columns = -(-counts.shape[0] // factor), -(-counts.shape[1] // factor)
+            padded = numpy.zeros((rows * factor, columns * factor), numpy.int64)
+            padded[:counts.shape[0], :counts.shape[1]] = counts
+            level_counts = padded.reshape(rows, factor, columns, factor).sum(axis=(1, 3))
+            # pixels of the mask in each block, less than block_size squared along the right and bottom edges
+            widths = numpy.minimum(block_size, width - numpy.arange(columns) * block_size)
+            heights = numpy.minimum(block_size, height - numpy.arange(rows) * block_size)
+            full = level_counts == numpy.outer(heights, widths)
+            self.levels.append((block_size, blocks_mask(level_counts > 0), blocks_mask(full), blocks_mask(~full)))
+
+    def occupancy(self, rect: pygame.rect.Rect) -> int | None:
+        """EMPTY if none of the mask inside rect (relative to the mask) is solid, FULL if all of it is, MIXED if some of it is
+        or None if that can't be told without testing pixels"""
+        area = rect.clip(self.rect)
+        if not area:
+            return EMPTY
+        left, top, right, bottom = area.left, area.top, area.right - 1, area.bottom - 1
+        for block_size, any_solid, all_solid, not_full in self.levels:
+            x, y = left // block_size, top // block_size
+            size = (right // block_size + 1 - x, bottom // block_size + 1 - y)
+            blocks = filled_mask(size)
+            if any_solid.overlap(blocks, (x, y)) is None:
+                return EMPTY
+            if not_full.overlap(blocks, (x, y)) is None:
+                return FULL
+            # rect covers at least one pixel of every block it touches, so any full block means some of rect is solid
+            if all_solid.overlap(blocks, (x, y)) is not None:
+                return MIXED
+        return None
+
+
+class MaskShape:
+    """a mask split into big solid rectangles and the pixels left over (edges and slopes)
+
+    most collision tests are then a rect test, only tests near the edges need the mask
+    the occupancy pyramid is for questions about bigger areas (sweeps), a single overlap with the edge mask is
+    already quicker than going down the pyramid for one rect"""
+
+    def __init__(self, mask: pygame.mask.Mask, rects, runs: numpy.ndarray):
+        self.mask = mask
+        self.runs = runs
+        self.pyramid = OccupancyPyramid(runs, mask.get_size())
+        self.headroom: numpy.ndarray | None = None      # see headroom_map, made the first time it is needed
+        self.headroom_bands = bytearray()               # which bands of columns of headroom have been worked out
+        self.rects = [pygame.rect.Rect(rect) for rect in rects.tolist()]
+        self.edge_mask = mask.copy()
+        for rect in self.rects:
+            self.edge_mask.erase(filled_mask(rect.size), rect.topleft)
+
+    def collide_rect(self, rect: pygame.rect.Rect) -> bool:
+        # rect is relative to the top left of the mask
+        if self.rects and rect.collidelist(self.rects) != -1:
+            return True
+        return self.edge_mask.overlap(filled_mask(rect.size), rect.topleft) is not None
+
+    def clear_tops(self, x: int, width: int, height: int, tops: list[int], clear: list[bool]):
+        """sets clear[i] to False if a rect of this size at (x, tops[i]) (relative to the mask) overlaps it
+        every height is looked up in the headroom map at once, so trying a few heights is about the same as trying one"""
+        mask_width, mask_height = self.mask.get_size()
+        left, right = max(x, 0), min(x + width, mask_width)
+        if right <= left:
+            return
+        if height > MAX_HEADROOM:
+            for i, top in enumerate(tops):
+                if clear[i] and self.collide_rect(pygame.rect.Rect(x, top, width, height)):
+                    clear[i] = False
+            return
+
+        # the bottom row of each rect that is on the mask and how much room it needs above that row
+        indices, rows, needed = [], [], []
+        for i, top in enumerate(tops):
+            bottom = min(top + height, mask_height) - 1
+            if clear[i] and bottom >= 0 and bottom >= top:
+                indices.append(i)
+                rows.append(bottom)
+                needed.append(bottom - top + 1)
+        if not indices:
+            return
+        fits = self.headroom_columns(left, right)[rows].min(axis=1) >= needed
+        for i, fit in zip(indices, fits.tolist()):
+            if not fit:
+                clear[i] = False
+
+    def headroom_columns(self, left: int, right: int) -> numpy.ndarray:
+        # columns left to right of the headroom map, working out any bands of them that haven't been needed before
+        # (so the first step up onto a huge image doesn't stall while the whole map is made)
+        width, height = self.mask.get_size()
+        if self.headroom is None:
+            # zeros are only given memory when written to, so the bands that are never needed don't take up any
+            self.headroom = numpy.zeros((height, width), numpy.uint8)
+            self.headroom_bands = bytearray(-(-width // HEADROOM_BAND))
+        for band in range(left // HEADROOM_BAND, (right - 1) // HEADROOM_BAND + 1):
+            if not self.headroom_bands[band]:
+                band_left, band_right = band * HEADROOM_BAND, min((band + 1) * HEADROOM_BAND, width)
+                self.headroom[:, band_left:band_right] = headroom_map(self.runs, height, band_left, band_right)
+                self.headroom_bands[band] = 1
+        return self.headroom[:, left:right]
@@ -2,6 +2,24 @@ WIDTH, HEIGHT = 1000, 800
 
 FPS = 120
 
+# physics runs at a fixed rate no matter the frame rate, drawing interpolates between the last two physics ticks
+PHYSICS_HZ = 240
+PHYSICS_DT = 1 / PHYSICS_HZ
+MAX_PHYSICS_STEPS = 8       # most physics ticks run in one frame, stops slow frames making the next frame even slower
+
+# level images bigger than this (in pixels) are split into tiles that are loaded when needed
+TILED_IMAGE_AREA = 4096 * 4096
+TILE_SIZE = 256
+TILE_MEMORY_BUDGET = 64 * 1024 * 1024      # bytes of tiles kept in memory
+
+# moving platforms further than this (in pixels) from the screen and player aren't moved until they get closer
+ACTIVE_MARGIN = 512
+ACTIVE_CELL_SIZE = 1024     # cell size of the grid of moving platform paths
+
+# platforms that don't move are drawn once into chunks this big, which are kept under a memory budget
+STATIC_CHUNK_SIZE = 512
+STATIC_MEMORY_BUDGET = 64 * 1024 * 1024     # bytes of chunks kept in memory
+
 HELP_MESSAGE = """\
 HELP MENU
 H brings up this menu
@@ -14,7 +32,15 @@ M changes modes:
 - Platformer mode lets you control the player
 - Edit mode lets you click to place platforms
     - You can still move around (hold shift to move faster)
+    - Platforms you place are saved with the level (level.json and level.journal in its folder)
     
-F1 starts recording coordinates of the player in a list
-F2 prints some info about that list
+F1 starts/stops recording a replay (saved in the replays folder)
+F2 plays back the last replay
+
+F3 toggles the profiler overlay (how long each part of a frame takes)
+F4 saves the profiled frames as a chrome trace and a csv (in the profiles folder)
+
+F5 starts/stops watching the level folder, changed images are reloaded without restarting
+
+F6 toggles only redrawing the parts of the screen that change
 """
@@ -1,22 +1,65 @@
 import pygame
 import os
+import time
+from contextlib import contextmanager
 
 from consts import *
 
-from platforms import Platform, Rectangle, Circle, ImageStage
+from platforms import Platform, Rectangle, Circle, ImageStage, TiledImageStage
 from kill_area import KillArea
 from portal import Portal
 from player import Player
+from broadphase import SpatialGrid
+from triggers import Trigger, TriggerLayer
+from static_layer import StaticLayer
+from tile_cache import TileCache
+from level_cache import load_images
+from inputs import ScriptedInput, LEFT, RIGHT, JUMP, JUMP_PRESS, JUMP_RELEASE, DASH, RESET, held_from_keys
+from replay import Replay, ReplayRecorder
+from snapshot import Snapshot
+from level_file import LevelJournal, COMPACT_AFTER, decode, vel_path_of
+from level_watcher import LevelWatcher
+from profiler import FrameProfiler
 
 
 class Game:
-    def __init__(self):
-        self.win = pygame.display.set_mode((WIDTH, HEIGHT))
+    def __init__(self, level_path: str="levels/4", headless: bool=False):
+        self.headless = headless        # headless games have no window and are stepped manually with simulate
+        if headless:
+            # images still need a display to be converted, the dummy driver gives one without opening a window
+            # it is only set while the display starts, the environment is put back afterwards so it doesn't leak into
+            # anything else the process runs
+            driver = os.environ.get("SDL_VIDEODRIVER")
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            try:
+                self.win = pygame.display.set_mode((WIDTH, HEIGHT))
+            finally:
+                if driver is None:
+                    del os.environ["SDL_VIDEODRIVER"]
+                else:
+                    os.environ["SDL_VIDEODRIVER"] = driver
+        else:
+            if pygame.display.get_init() and pygame.display.get_driver() == "dummy" and os.environ.get("SDL_VIDEODRIVER") != "dummy":
+                # a headless game started the display without a window, start it again for real (that game's window
+                # surface stops working)
+                pygame.display.quit()
+            self.win = pygame.display.set_mode((WIDTH, HEIGHT))
         
         self.clock = pygame.time.Clock()
         
+        self.level_path = level_path
         self.player: Player = Player(self.win)
         self.platforms: list[Platform | Circle | ImageStage]
+        self.broadphase = SpatialGrid()      # spatial index of self.platforms so collisions only test nearby platforms
+        self.tile_cache = TileCache(TILE_MEMORY_BUDGET)     # tiles of huge level images (TiledImageStage) that are in memory
+        # only platforms with a vel_path are ticked (static ones sleep), movers are indexed by everywhere their path
+        # can take them so only the ones near the player and screen are moved, the rest catch up when they get close
+        self.movers = SpatialGrid(ACTIVE_CELL_SIZE)
+        self.drifting_platforms: list[Platform] = []   # movers whose path doesn't loop back, these are always ticked
+        self.moving_platforms: list[Platform] = []     # every mover in the order they were added
+        self.platform_time = 0.0                        # seconds of platform movement simulated
+        self.static_layer = StaticLayer(STATIC_CHUNK_SIZE, TileCache(STATIC_MEMORY_BUDGET))    # platforms that never move, pre drawn
+        self.cached_active_rect = pygame.rect.Rect(0, 0, 0, 0)
         # self.platforms = [Platform((-1000, HEIGHT - 300), (100, 300), self.win),
         #                   Platform((WIDTH + 1900, HEIGHT - 300), (100, 300), self.win), 
         #                   Platform((0, 600), (WIDTH, 100), self.win), Platform((600, 200), (100, 500), self.win),
@@ -29,23 +72,61 @@ class Game:
         #                   Circle((200, 300), 30, self.win), Circle((0, 300), 100, self.win)]
         # self.kill_areas = [KillArea((540, 400), (60, 50), self.win)]
         
-        self.load_level_from_images("levels/4")
+        self.triggers = TriggerLayer()      # kill areas and portals, indexed so the player only tests the ones near it
+        self.portals: list[Portal] = []
+        self.kill_areas: list[KillArea] = []
+        
+        self.journal: LevelJournal | None = None        # where edits to the level are saved
+        self.watcher: LevelWatcher | None = None        # watches the level's pngs for changes while F5 is on
+        self.screen_coords = [0.0, 0.0]     # coords of the top left corner of the screen
+        self.load_level(level_path)
         
         #self.platforms.append(Rectangle((500, 200), (500, 500), self.win, (-20, 0)))
         #self.platforms.append(ImageStage("rect.png", self.win, (498, 200), [((-50, 0), 2), ((0, -50), 2), ((50, 0), 2), ((0, 50), 2)]))
-        self.portals = [Portal((1080, 380), (450, 180), (20, 100), self.win)]
-        #self.portals = []
         #self.platforms.append(Circle((500, 0), 250, self.win, (-10, 5)))
         
-        self.kill_areas = []
-        
         self.running: bool = False
         
-        self.screen_coords = [0.0, 0.0]     # coords of the top left corner of the screen
-        
         self.mode = 0   # 0-platformer, 1-editing
         
         self.last_mouse_click: tuple[int, int] | None = None        # used for placing platforms in edit mode
+        
+        self.pending_input = 0          # key presses (inputs.JUMP_PRESS etc) since the last tick
+        
+        self.physics_accumulator = 0.0     # time that hasn't been simulated yet, in seconds
+        self.interpolation = 1.0           # how far between the previous and current physics tick to draw (0-1)
+        self.previous_state: list[tuple[object, float, float]] | None = None    # positions before the last physics tick
+        self.previous_screen_coords = list(self.screen_coords)
+        
+        self.dirty_rendering = False        # only redraw the parts of the screen that changed when the screen isn't scrolling
+        self.full_redraw = True             # set when something changes that isn't tracked by the dirty rects (eg a new platform)
+        self.last_drawn_screen_coords: tuple[float, float] | None = None
+        self.last_moving_rects: dict[int, tuple[tuple, pygame.rect.Rect]] = {}
+        self.last_caption_time = -1000
+        
+        self.recorder: ReplayRecorder | None = None     # records inputs to a replay file while F1 is on
+        self.last_replay_path: str | None = None
+        self.playback: Replay | None = None             # replay being played back instead of the keyboard
+        
+        self.profiler = FrameProfiler(self)     # times each part of a frame, F3 shows it and F4 saves it
+    
+    def load_level(self, folder_path):
+        # levels saved by the editor are loaded from their level file, otherwise the level is just the pngs in the folder
+        self.clear_platforms()
+        self.clear_triggers()
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = LevelJournal(folder_path) if folder_path else None
+        if self.journal is not None and self.journal.exists():
+            self.load_level_from_file()
+        else:
+            self.load_level_from_images(folder_path)
+            self.add_trigger(Portal((1080, 380), (450, 180), (20, 100), self.win))
+        
+        # a new level starts from the beginning, R puts everything back to this
+        self.player.reset()
+        self.screen_coords = [0.0, 0.0]
+        self.start_snapshot = self.snapshot()
     
     def load_level_from_images(self, folder_path):
         files = []
@@ -54,10 +135,180 @@ class Game:
             break
         
         image_paths = [f"{folder_path}/{file}" for file in files if file.endswith(".png")]
+        self.add_images(image_paths)
+    
+    def add_images(self, image_paths: list[str], coords: list[tuple[float, float]] | None=None,
+                   vel_paths: list[list[tuple[tuple[float, float], float]] | None] | None=None):
+        for stage in self.make_image_stages(image_paths, coords, vel_paths):
+            self.add_platform(stage)
+    
+    def make_image_stages(self, image_paths: list[str], coords: list[tuple[float, float]] | None=None,
+                          vel_paths: list[list[tuple[tuple[float, float], float]] | None] | None=None) -> list[ImageStage]:
+        # images are read and decoded and have their masks made in parallel (tiled images don't need a full mask)
+        progress = None if self.headless else self.draw_loading
+        stages = []
+        for i, compiled in enumerate(load_images(image_paths, max_mask_area=TILED_IMAGE_AREA, progress=progress)):
+            image = image_paths[i]
+            position = (0, 0) if coords is None else coords[i]
+            vel_path = None if vel_paths is None else vel_paths[i]
+            width, height = compiled.image.get_size()
+            if width * height > TILED_IMAGE_AREA:
+                # too big to keep all of it in memory, stream it in tiles
+                stages.append(TiledImageStage(image, self.win, self.tile_cache, position, vel_path, compiled=compiled))
+            else:
+                stages.append(ImageStage(image, self.win, position, vel_path, compiled=compiled))
+        return stages
+    
+    def image_stage(self, file_path: str) -> ImageStage | None:
+        file_path = os.path.normpath(file_path)
+        for platform in self.platforms:
+            if isinstance(platform, ImageStage) and os.path.normpath(platform.file_path) == file_path:
+                return platform
+        return None
+    
+    def reload_images(self, changed: list[str], added: list[str], removed: list[str]):
+        """swaps in new image stages for changed pngs, adds new ones and removes deleted ones
+        changed stages keep their place, position and path, nothing else (the player, the camera...) is touched
+        every png is decoded before the level is changed, if one can't be read yet only the removals happen (and are saved)
+        and the others are tried again next poll"""
+        paths = changed + added
+        olds = [self.image_stage(file_path) for file_path in paths]
+        try:
+            stages = self.make_image_stages(paths, [(0, 0) if old is None else old.path_start for old in olds],
+                                            [None if old is None else old.vel_path for old in olds])
+        except (pygame.error, OSError, ValueError) as error:
+            print(f"couldn't reload images ({error}), trying again")
+            for file_path in paths:
+                self.watcher.retry(file_path)
+            changed, added, olds, stages = [], [], [], []
         
+        for file_path in removed:
+            stage = self.image_stage(file_path)
+            if stage is not None:
+                self.remove_platform(stage)
+        for old, stage in zip(olds, stages):
+            if old is None:
+                self.add_platform(stage)
+            else:
+                self.replace_platform(old, stage)
+        self.start_snapshot.track_platforms(self)
+        
+        if (added or removed) and self.journal is not None and self.journal.exists():
+            self.journal.compact(self.level_objects())
+        if changed or added or removed:
+            print(f"reloaded {len(changed)} changed, {len(added)} added and {len(removed)} removed images")
+    
+    def poll_level_files(self):
+        changed, added, removed = self.watcher.poll()
+        if changed or added or removed:
+            self.reload_images(changed, added, removed)
+    
+    def load_level_from_file(self):
+        journal = self.journal
+        records = journal.load()
+        images = [record for record in records if record["kind"] == "image"]
+        # images are loaded together so it can be done in parallel, they come first like they do in levels made of pngs
+        self.add_images([os.path.join(journal.folder, record["file"]) for record in images],
+                        [(record["x"], record["y"]) for record in images], [vel_path_of(record) for record in images])
+        for record in records:
+            if record["kind"] == "image":
+                continue
+            obj = decode(record, self.win)
+            if isinstance(obj, Platform):
+                self.add_platform(obj)
+            else:
+                self.add_trigger(obj)
+        if journal.entries:
+            # fold the journal in now so the next load is a single read
+            journal.compact(self.level_objects())
+    
+    def level_objects(self) -> list:
+        # everything saved in the level file
+        return self.platforms + self.triggers.triggers
+    
+    def save_edit(self, obj):
+        # saves something placed in the editor straight away
+        journal = self.journal
+        if journal is None:
+            return
+        if not journal.exists():
+            # first edit of a level made of pngs, save the whole level to start from
+            journal.compact(self.level_objects())
+            return
+        journal.append(obj)
+        if journal.entries >= COMPACT_AFTER:
+            journal.compact(self.level_objects())
+    
+    def draw_loading(self, loaded: int, total: int, file_path: str):
+        # progress bar while a level loads
+        pygame.event.pump()     # stops the window being marked as not responding
+        self.win.fill(pygame.Color("white"))
+        bar = pygame.rect.Rect(WIDTH // 4, HEIGHT // 2 - 10, WIDTH // 2, 20)
+        pygame.draw.rect(self.win, pygame.Color("black"), bar, 2)
+        pygame.draw.rect(self.win, pygame.Color("black"), (bar.x, bar.y, bar.width * loaded // total, bar.height))
+        pygame.display.update()
+        pygame.display.set_caption(f"loading {loaded}/{total} ({os.path.basename(file_path)})")
+    
+    def remove_platform(self, platform: Platform):
+        self.platforms.remove(platform)
+        self.broadphase.remove(platform)
+        self.movers.remove(platform)
+        if platform in self.drifting_platforms:
+            self.drifting_platforms.remove(platform)
+        if platform in self.moving_platforms:
+            self.moving_platforms.remove(platform)
+        if platform in self.static_layer:
+            self.static_layer.remove(platform)
+        self.tile_cache.discard(platform)
+        if self.player.platform_touching is platform:
+            self.player.platform_touching = None
+        self.full_redraw = True
+    
+    def replace_platform(self, old: Platform, new: Platform):
+        # new takes old's place in the draw and collision order as well as it can
+        index = self.platforms.index(old)
+        self.remove_platform(old)
+        self.add_platform(new)
+        self.platforms.insert(index, self.platforms.pop())
+    
+    def clear_platforms(self):
         self.platforms = []
-        for image in image_paths:
-            self.platforms.append(ImageStage(image, self.win))
+        self.broadphase.clear()
+        self.tile_cache.clear()
+        self.movers.clear()
+        self.drifting_platforms = []
+        self.moving_platforms = []
+        self.static_layer.clear()
+        self.platform_time = 0.0
+    
+    def add_platform(self, platform: Platform):
+        self.platforms.append(platform)
+        self.broadphase.insert(platform)
+        if platform.vel_path:
+            # starts where every other mover is along its path so they all stay in step
+            platform.move_to(self.platform_time, broadphase=self.broadphase)
+            self.moving_platforms.append(platform)
+            path_bounds = platform.path_bounds()
+            if path_bounds is None:
+                self.drifting_platforms.append(platform)
+            else:
+                self.movers.insert(platform, path_bounds)
+        else:
+            self.static_layer.add(platform)
+        self.full_redraw = True
+    
+    def clear_triggers(self):
+        self.triggers.clear()
+        self.portals = []
+        self.kill_areas = []
+    
+    def add_trigger(self, trigger: Trigger):
+        if isinstance(trigger, Portal):
+            self.portals.append(trigger)
+        elif isinstance(trigger, KillArea):
+            self.kill_areas.append(trigger)
+        self.triggers.add(trigger)
+        self.full_redraw = True
     
     def run(self):
         self.running = True
@@ -86,33 +337,121 @@ class Game:
             difference = self.player.y + self.player.height - upper_third
             self.screen_coords[1] += difference / 10
 
-    def draw(self):
-        self.win.fill(pygame.Color("white"))
-        
+    @property
+    def view_rect(self) -> pygame.rect.Rect:
+        # the part of the level that is on the screen
+        return pygame.rect.Rect(self.screen_coords, (WIDTH, HEIGHT))
+    
+    def edit_preview_rect(self) -> pygame.rect.Rect | None:
+        # the rect that will currently be placed if there is another click, in screen coordinates
+        if not self.last_mouse_click:
+            return None
+        x, y = pygame.mouse.get_pos()
+
+        topleft_x = min(x, self.last_mouse_click[0] - int(self.screen_coords[0]))
+        topleft_y = min(y, self.last_mouse_click[1] - int(self.screen_coords[1]))
+
+        return pygame.rect.Rect(topleft_x, topleft_y, abs(self.last_mouse_click[0] - int(self.screen_coords[0]) - x), abs(self.last_mouse_click[1] - int(self.screen_coords[1]) - y))
+    
+    def prefetch_tiles(self):
+        # load the tiles of streamed images around the screen and player before they are needed
+        around = self.view_rect.union(self.player.rect).inflate(TILE_SIZE * 2, TILE_SIZE * 2)
+        for platform in self.broadphase.query(around):
+            if isinstance(platform, TiledImageStage):
+                platform.prefetch(around)
+    
+    def draw_scene(self, view: pygame.rect.Rect):
+        # draws everything that overlaps view (in level coordinates)
         self.player.draw(self.screen_coords)
         
-        for platform in self.platforms:
-            platform.draw(self.screen_coords)
+        # static platforms are blitted from the pre drawn layer, only moving ones are drawn one by one
+        self.static_layer.draw(self.win, self.screen_coords, view)
+        for platform in self.movers.query(view) + self.drifting_platforms:
+            if view.colliderect(platform.bounds):
+                platform.draw(self.screen_coords)
             
-        for kill_area in self.kill_areas:
-            kill_area.draw(self.screen_coords)
+        # the trigger grid finds the kill areas and portals on screen, kill areas are drawn first so portals are on top
+        triggers = self.triggers.triggers_in(view)
+        for trigger in triggers:
+            if isinstance(trigger, KillArea):
+                trigger.draw(self.screen_coords)
         
-        for portal in self.portals:
-            portal.draw(self.screen_coords)
+        for trigger in triggers:
+            if isinstance(trigger, Portal):
+                trigger.draw(self.screen_coords)
         
-        if self.last_mouse_click:
-            # draw the rect that will currently be placed if there is another click
-            x, y = pygame.mouse.get_pos()
-
-            topleft_x = min(x, self.last_mouse_click[0] - int(self.screen_coords[0]))
-            topleft_y = min(y, self.last_mouse_click[1] - int(self.screen_coords[1]))
-
-            pygame.draw.rect(self.win, pygame.Color("black"),
-                (topleft_x, topleft_y, abs(self.last_mouse_click[0] - int(self.screen_coords[0]) - x), abs(self.last_mouse_click[1] - int(self.screen_coords[1]) - y)))
+        preview = self.edit_preview_rect()
+        if preview:
+            pygame.draw.rect(self.win, pygame.Color("black"), preview)
+    
+    def moving_screen_rects(self) -> dict[int, tuple[tuple, pygame.rect.Rect]]:
+        # screen rects of everything that can change between frames, used to find what needs redrawing
+        # each one is stored with its exact position so sub pixel movement is still noticed
+        screen_x, screen_y = self.screen_coords
+        player = self.player
+        # the player is always redrawn since the dash bar changes even when it isn't moving
+        rects = {id(player): (None, player.screen_rect(self.screen_coords).copy())}
+        # only things that can be on screen are looked at, anything that has just gone off it drops out of the dict which
+        # redraws where it was
+        view = self.view_rect.inflate(8, 8)     # a bit bigger to cover rounding when drawing
+        for platform in self.movers.query(view) + self.drifting_platforms:
+            rects[id(platform)] = ((platform.x, platform.y), platform.bounds.move(-screen_x, -screen_y))
+        for trigger in self.triggers.triggers_in(view):
+            if not trigger.moving:
+                continue        # the rest never move (adding or removing one redraws everything)
+            if isinstance(trigger, Portal):
+                rects[id(trigger)] = ((trigger.x_1, trigger.y_1, trigger.x_2, trigger.y_2),
+                                      trigger.screen_rect_1(self.screen_coords).union(trigger.screen_rect_2(self.screen_coords)))
+            else:
+                rects[id(trigger)] = ((trigger.x, trigger.y), trigger.screen_rect(self.screen_coords).copy())
+        preview = self.edit_preview_rect()
+        if preview:
+            rects[id(self.last_mouse_click)] = (tuple(preview), preview)
+        return rects
+    
+    def draw(self):
+        self.prefetch_tiles()
         
-        pygame.display.update()
+        with self.interpolated():
+            drawn_screen_coords = tuple(self.screen_coords)
+            moving_rects = self.moving_screen_rects() if self.dirty_rendering else {}
+            
+            if not self.dirty_rendering or self.full_redraw or drawn_screen_coords != self.last_drawn_screen_coords:
+                # everything has moved (or changed), redraw the whole screen
+                self.win.fill(pygame.Color("white"))
+                self.draw_scene(self.view_rect)
+                pygame.display.update()
+            else:
+                # only redraw the places where something was or is now
+                screen = self.win.get_rect()
+                dirty = []
+                for key, (position, rect) in moving_rects.items():
+                    previous = self.last_moving_rects.get(key)
+                    if position is None or previous is None or previous[0] != position:
+                        dirty.append(rect.inflate(4, 4))     # a bit bigger to cover rounding when drawing
+                        if previous is not None:
+                            dirty.append(previous[1].inflate(4, 4))
+                for key, (_, previous_rect) in self.last_moving_rects.items():
+                    if key not in moving_rects:
+                        dirty.append(previous_rect.inflate(4, 4))
+                dirty = [rect.clip(screen) for rect in dirty if rect.colliderect(screen)]
+                
+                for rect in dirty:
+                    self.win.set_clip(rect)
+                    self.win.fill(pygame.Color("white"))
+                    self.draw_scene(rect.move(drawn_screen_coords))
+                self.win.set_clip(None)
+                pygame.display.update(dirty)
+            
+            self.full_redraw = False
+            self.last_drawn_screen_coords = drawn_screen_coords
+            self.last_moving_rects = moving_rects
         
-        pygame.display.set_caption(str(round(self.clock.get_fps(), 2)))
+        # changing the caption is slow so only do it a couple of times a second
+        now = pygame.time.get_ticks()
+        if now - self.last_caption_time > 500:
+            pygame.display.set_caption(str(round(self.clock.get_fps(), 2)))
+            self.last_caption_time = now
     
     def handle_mouse_down(self, event):
         mouse_coords = pygame.mouse.get_pos()
@@ -132,7 +471,8 @@ class Game:
                 max_x = max(mouse_x, self.last_mouse_click[0])
                 max_y = max(mouse_y, self.last_mouse_click[1])
                 platform = Platform((min_x, min_y), (max_x - min_x, max_y - min_y), self.win)
-                self.platforms.append(platform)
+                self.add_platform(platform)
+                self.save_edit(platform)
                 self.last_mouse_click = None
     
     def handle_key_down(self, event: pygame.event.Event):
@@ -140,49 +480,212 @@ class Game:
             print(HELP_MESSAGE)
         
         elif event.key == pygame.K_SPACE:
-            self.player.jump(wall_jump=True)
+            self.pending_input |= JUMP_PRESS
         elif event.key == pygame.K_f:
-            self.player.dash()
+            self.pending_input |= DASH
         elif event.key == pygame.K_r:
-            self.player.reset()
+            self.pending_input |= RESET
         elif event.key == pygame.K_m:
             self.mode += 1
             self.mode %= 2      # change to be the amount of modes
             
             self.last_mouse_click = None
         
+        elif event.key == pygame.K_F5:
+            if self.watcher is None and self.level_path:
+                self.watcher = LevelWatcher(self.level_path)
+                print(f"watching {self.level_path} for changed images")
+            else:
+                self.watcher = None
+                print("stopped watching for changed images")
+        
+        elif event.key == pygame.K_F6:
+            self.dirty_rendering = not self.dirty_rendering
+            self.full_redraw = True
+        
+        elif event.key == pygame.K_F3:
+            self.profiler.toggle()
+            self.full_redraw = True
+        
+        elif event.key == pygame.K_F4:
+            if self.profiler.frames:
+                print("saved profile to {} and {}".format(*self.profiler.export()))
+        
         elif event.key == pygame.K_F1:
-            self.player.recording = not self.player.recording
-            if self.player.recording:
-                self.player.recorded_coords = []
+            if self.recorder is None:
+                self.last_replay_path = f"replays/{time.strftime('%Y%m%d-%H%M%S')}.rpl"
+                self.recorder = ReplayRecorder(self, self.last_replay_path)
+                print(f"recording to {self.last_replay_path}")
+            else:
+                size = self.recorder.close()
+                print(f"recorded {self.recorder.ticks} ticks to {self.last_replay_path} ({size} bytes)")
+                self.recorder = None
             
         elif event.key == pygame.K_F2:
-            x = [coords[0] for coords in self.player.recorded_coords]
-            y = [coords[1] for coords in self.player.recorded_coords]
-            print(min(y), max(y), max(y) - min(y))
+            if self.recorder is None and self.last_replay_path is not None:
+                self.start_playback(Replay.load(self.last_replay_path))
     
     def handle_key_up(self, event: pygame.event.Event):
         if event.key == pygame.K_SPACE:
-            self.player.stop_jump()
+            self.pending_input |= JUMP_RELEASE
     
-    def loop_platformer(self):
+    def read_keyboard(self) -> int:
+        # inputs for this tick from the keyboard, in the same form as inputs.ScriptedInput
+        bits = held_from_keys(pygame.key.get_pressed()) | self.pending_input
+        self.pending_input = 0
+        return bits
+    
+    def apply_input(self, bits: int):
+        # presses happen before the held keys are updated, same as when they were handled as events
+        if bits & RESET:
+            # a retry still counts the deaths before it
+            deaths = self.player.deaths
+            self.reset_world()
+            self.player.deaths = deaths
+        if bits & JUMP_PRESS:
+            self.player.jump(wall_jump=True)
+        if bits & JUMP_RELEASE:
+            self.player.stop_jump()
+        if bits & DASH:
+            self.player.dash()
+        
         # tell player what keys are being pressed
-        keys_pressed = pygame.key.get_pressed()
-        self.player.right = keys_pressed[pygame.K_RIGHT] or keys_pressed[pygame.K_d]
-        self.player.left = keys_pressed[pygame.K_LEFT] or keys_pressed[pygame.K_a]
-        self.player.jumping = keys_pressed[pygame.K_SPACE]
+        self.player.right = bool(bits & RIGHT)
+        self.player.left = bool(bits & LEFT)
+        self.player.jumping = bool(bits & JUMP)
     
-        # update platforms (in case they are moving)
-        for platform in self.platforms:
-            platform.tick(self.player, self.clock.get_time() / 1000)
+    def step(self, bits: int, dt: float):
+        # advances the platformer by one tick of dt seconds with the given inputs
+        self.apply_input(bits)
+    
+        self.tick_platforms(dt)
+        self.triggers.tick(dt)
         
         # update player
-        self.player.tick(self.platforms, self.kill_areas, self.portals, self.clock.get_time() / 1000)     # / 1000 turns dt into seconds
+        self.player.tick(self.broadphase, self.triggers, dt)
     
         # scroll screen after player has moved
         self.control_screen_scroll()
         
+        if self.recorder is not None:
+            self.recorder.record(bits, self.player)
+    
+    def snapshot(self) -> Snapshot:
+        # the state of everything that moves, restore it to come back to this tick
+        return Snapshot(self)
+    
+    def restore(self, snapshot: Snapshot):
+        snapshot.restore(self)
+        self.previous_state = None      # don't interpolate across the jump
+    
+    def reset_world(self):
+        # puts the player, moving platforms and triggers back how they were when the level was loaded
+        self.restore(self.start_snapshot)
+    
+    def start_playback(self, replay: Replay):
+        replay.restore(self)
+        self.playback = replay
+        self.previous_state = None
+        self.mode = 0
+    
+    def step_playback(self):
+        # plays the next tick of the replay, stopping when it runs out
+        replay = self.playback
+        self.step(replay.next(), replay.dt)
+        if not replay.matches(self.player):
+            print(f"replay doesn't match the recording at tick {replay.pointer}")
+        if replay.finished:
+            self.playback = None
+    
+    @property
+    def active_rect(self) -> pygame.rect.Rect:
+        # movers whose paths reach into this are moved every tick, the rest are left where they are until they are needed
+        # (the same rect every time, don't keep it)
+        rect = self.cached_active_rect
+        rect.update(self.screen_coords, (WIDTH, HEIGHT))
+        rect.union_ip(self.player.rect)
+        rect.inflate_ip(ACTIVE_MARGIN * 2, ACTIVE_MARGIN * 2)
+        return rect
+    
+    def tick_platforms(self, dt: float):
+        # update moving platforms, static ones never move so they aren't ticked at all
+        previous_time = self.platform_time
+        self.platform_time += dt
+        for platform in self.movers.query(self.active_rect) + self.drifting_platforms:
+            if platform.path_time != previous_time:
+                # it was asleep, jump it straight to where it would have been without carrying the player
+                platform.move_to(previous_time, broadphase=self.broadphase)
+            platform.move_to(self.platform_time, self.player, self.broadphase)
+    
+    def save_previous_state(self):
+        # positions of everything that can move near the screen, so drawing can interpolate from them
+        # (sleeping movers don't move and anything further away isn't drawn, so they are left out)
+        active_rect = self.active_rect
+        state = [(self.player, self.player.x, self.player.y)]
+        for platform in self.movers.query(active_rect) + self.drifting_platforms:
+            state.append((platform, platform.x, platform.y))
+        if self.triggers.moving:
+            for trigger in self.triggers.triggers_in(active_rect):
+                if trigger.moving:
+                    state.append((trigger, trigger.x, trigger.y))
+        self.previous_state = state
+        self.previous_screen_coords = list(self.screen_coords)
+    
+    @contextmanager
+    def interpolated(self):
+        # temporarily moves everything to where it would be between the last two physics ticks for drawing
+        if self.previous_state is None or self.interpolation >= 1:
+            yield
+            return
+        
+        alpha = self.interpolation
+        current = [(obj, obj.x, obj.y) for obj, _, _ in self.previous_state]
+        current_screen_coords = self.screen_coords
+        for (obj, prev_x, prev_y), (_, x, y) in zip(self.previous_state, current):
+            if abs(x - prev_x) + abs(y - prev_y) < 200:     # don't smear teleports (portals, resets)
+                obj.x = prev_x + (x - prev_x) * alpha
+                obj.y = prev_y + (y - prev_y) * alpha
+        self.screen_coords = [prev + (cur - prev) * alpha for prev, cur in zip(self.previous_screen_coords, current_screen_coords)]
+        try:
+            yield
+        finally:
+            for obj, x, y in current:
+                obj.x, obj.y = x, y
+            self.screen_coords = current_screen_coords
+    
+    def loop_platformer(self):
+        # run as many fixed physics ticks as fit in the time since the last frame
+        frame_time = self.clock.get_time() / 1000       # / 1000 turns dt into seconds
+        self.physics_accumulator = min(self.physics_accumulator + frame_time, MAX_PHYSICS_STEPS * PHYSICS_DT)
+        
+        bits = self.read_keyboard()
+        steps = 0
+        while self.physics_accumulator >= PHYSICS_DT and steps < MAX_PHYSICS_STEPS:
+            self.save_previous_state()
+            if self.playback is not None:
+                self.step_playback()
+            else:
+                self.step(bits, PHYSICS_DT)
+                bits &= LEFT | RIGHT | JUMP         # presses only happen on the first tick
+            self.physics_accumulator -= PHYSICS_DT
+            steps += 1
+        
+        if steps == 0 and self.playback is None:
+            # keep presses for the next frame that does run a tick
+            self.pending_input |= bits & ~(LEFT | RIGHT | JUMP)
+        
+        self.interpolation = self.physics_accumulator / PHYSICS_DT
+    
+    def simulate(self, script: ScriptedInput, dt: float=PHYSICS_DT, ticks: int | None=None):
+        # runs the script as fast as possible without drawing, for headless games
+        if ticks is None:
+            ticks = len(script)
+        for _ in range(ticks):
+            self.step(script.next(), dt)
+        
     def loop_editor(self):
+        self.previous_state = None      # nothing moves in edit mode so don't interpolate
+        
         # scroll the screen if arrows or wasd are pressed, scroll faster if shift is also pressed
         keys_pressed = pygame.key.get_pressed()
         if keys_pressed[pygame.K_LSHIFT]:
@@ -199,15 +702,12 @@ class Game:
         if keys_pressed[pygame.K_s] or keys_pressed[pygame.K_DOWN]:
             self.screen_coords[1] += 5 * multiply
     
-    def loop(self):
-        # main loop
-        
-        self.clock.tick(FPS)
-        
+    def handle_events(self) -> bool:
+        # returns False if the window was closed
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.running = False
-                return
+                return False
             
             elif event.type == pygame.KEYDOWN:
                 self.handle_key_down(event)
@@ -217,10 +717,25 @@ class Game:
                     
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 self.handle_mouse_down(event)
-            
+        return True
+    
+    def loop(self):
+        # main loop
+        
+        self.clock.tick(FPS)
+        self.profiler.begin_frame()
+        
+        if not self.handle_events():
+            return
+        
+        if self.watcher is not None:
+            self.poll_level_files()
+        
         if self.mode == 0:
             self.loop_platformer()
         elif self.mode == 1:
+            self.pending_input = 0      # presses in edit mode don't control the player
             self.loop_editor()
         
         self.draw()
+        self.profiler.end_frame()
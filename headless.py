@@ -0,0 +1,50 @@
+import argparse
+import json
+import time
+
+from consts import *
+
+from game import Game
+from inputs import ScriptedInput
+
+
+def run_headless(game: Game, script: str | ScriptedInput, dt: float=PHYSICS_DT, ticks: int | None=None) -> dict:
+    """runs one scripted attempt on an already loaded headless game and returns where the player ended up
+
+    the level is only loaded once so many runs can share the same game, each one starts from how it was loaded"""
+    if isinstance(script, str):
+        script = ScriptedInput.parse(script)
+    script.rewind()
+    game.reset_world()
+
+    start = time.perf_counter()
+    game.simulate(script, dt, ticks)
+    elapsed = time.perf_counter() - start
+
+    ran = len(script) if ticks is None else ticks
+    return {
+        "x": game.player.x,
+        "y": game.player.y,
+        "deaths": game.player.deaths,
+        "ticks": ran,
+        "seconds": elapsed,
+        "ticks_per_second": ran / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the game without a window using a scripted input")
+    parser.add_argument("level", help="folder containing the level images, eg levels/2")
+    parser.add_argument("script", help='inputs, eg "right*120 right+jump*30 dash idle*60"')
+    parser.add_argument("--dt", type=float, default=PHYSICS_DT, help="seconds per tick")
+    parser.add_argument("--runs", type=int, default=1, help="how many times to repeat the script")
+    args = parser.parse_args()
+
+    game = Game(args.level, headless=True)
+    script = ScriptedInput.parse(args.script)
+    for _ in range(args.runs):
+        print(json.dumps(run_headless(game, script, args.dt)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import pygame
+
+
+# the inputs for one tick are stored as bit flags in a single int so they are cheap to script and record
+LEFT = 1
+RIGHT = 2
+JUMP = 4                # jump button is held down
+JUMP_PRESS = 8          # jump button was pressed this tick
+JUMP_RELEASE = 16       # jump button was released this tick
+DASH = 32               # dash was pressed this tick
+RESET = 64              # reset was pressed this tick
+
+NAMES = {"left": LEFT, "right": RIGHT, "jump": JUMP, "dash": DASH, "reset": RESET}
+
+
+def held_from_keys(keys_pressed) -> int:
+    # turns pygame.key.get_pressed() into the held down input flags
+    bits = 0
+    if keys_pressed[pygame.K_LEFT] or keys_pressed[pygame.K_a]:
+        bits |= LEFT
+    if keys_pressed[pygame.K_RIGHT] or keys_pressed[pygame.K_d]:
+        bits |= RIGHT
+    if keys_pressed[pygame.K_SPACE]:
+        bits |= JUMP
+    return bits
+
+
+class ScriptedInput:
+    """a fixed list of per tick inputs used instead of the keyboard, eg for headless runs
+
+    scripts are written as space separated tokens, each one is keys joined by + and optionally *ticks, for example
+    "right*120 right+jump*30 dash idle*60" holds right for 120 ticks, then right and jump for 30 and so on
+    dash and reset only count as pressed on the first tick of their token"""
+
+    def __init__(self, ticks: list[int]):
+        self.ticks = ticks
+        self.pointer = 0
+
+    @classmethod
+    def parse(cls, script: str) -> "ScriptedInput":
+        ticks = []
+        held_before = 0
+        for token in script.split():
+            keys, _, repeat = token.partition("*")
+            count = int(repeat) if repeat else 1
+            bits = 0
+            for name in keys.split("+"):
+                if name in ("idle", "-"):
+                    continue
+                if name not in NAMES:
+                    raise ValueError(f"unknown input {name!r} in script")
+                bits |= NAMES[name]
+            for i in range(count):
+                tick = bits if i == 0 else bits & ~(DASH | RESET)
+                # work out the press and release edges of the jump button
+                if tick & JUMP and not held_before & JUMP:
+                    tick |= JUMP_PRESS
+                elif held_before & JUMP and not tick & JUMP:
+                    tick |= JUMP_RELEASE
+                held_before = tick
+                ticks.append(tick)
+        return cls(ticks)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    @property
+    def finished(self) -> bool:
+        return self.pointer >= len(self.ticks)
+
+    def next(self) -> int:
+        # returns no input once the script has run out
+        if self.finished:
+            return 0
+        bits = self.ticks[self.pointer]
+        self.pointer += 1
+        return bits
+
+    def rewind(self):
+        self.pointer = 0
@@ -2,29 +2,37 @@ import pygame
 
 from consts import *
 
+from collision_shape import CachedRect
+from triggers import Trigger
 
-class KillArea:
+
+class KillArea(Trigger):
+    __slots__ = ("x", "y", "width", "height", "win", "moving", "x_vel", "y_vel", "cached_rect", "cached_screen_rect")
+    
+    lethal = True
+    
     def __init__(self, coords: tuple[float, float], dims, win: pygame.surface.Surface, moving=False):
         self.x, self.y = coords
         self.width, self.height = dims
         self.win = win
+        self.cached_rect, self.cached_screen_rect = CachedRect(), CachedRect()
         self.moving = moving
-        self.x_vel = 1.5
+        self.x_vel = 180        # pixels per second
         self.y_vel = 0
 
     @property
     def rect(self) -> pygame.rect.Rect:
-        # actual rect used for collisions
-        return pygame.rect.Rect(self.x, self.y, self.width, self.height)
+        # actual rect used for collisions (the same rect every time, don't keep it)
+        return self.cached_rect.get(self.x, self.y, self.width, self.height)
     
     def screen_rect(self, screen_cords) -> pygame.rect.Rect:
         # rect with regard to the coordinates (top left) of the screen so is used to draw
-        return pygame.rect.Rect(self.x - screen_cords[0], self.y - screen_cords[1], self.width, self.height)
+        return self.cached_screen_rect.get(self.x - screen_cords[0], self.y - screen_cords[1], self.width, self.height)
 
     def draw(self, screen_coords):
         pygame.draw.rect(self.win, pygame.Color("green"), self.screen_rect(screen_coords))
         
-    def tick(self):
+    def tick(self, dt: float):
         if self.moving:
-            self.x += self.x_vel
-            self.y += self.y_vel
+            self.x += self.x_vel * dt
+            self.y += self.y_vel * dt
@@ -0,0 +1,243 @@
+import pygame
+import numpy
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from collision_shape import solid_rects
+
+
+# compiled images are stored next to the level in a __levelcache__ folder, one file per png:
+#   header | pixels (width * height * 4 bytes, in the display's alpha format so no conversion is needed) | mask runs | solid rects
+# the mask is packed as runs of solid pixels along each row (y, start x, end x as int32s), which rebuilds the mask with
+# one draw per run instead of going over every pixel
+# solid rects (x, y, width, height as int32s) are the mask's big solid areas, see collision_shape.solid_rects
+# the header has a hash of the png so a cache file is rebuilt whenever the png changes
+CACHE_FOLDER = "__levelcache__"
+MAGIC = b"PLVL"
+VERSION = 2
+HEADER = struct.Struct("<4sI20sIIiiIIII")    # magic, version, sha1 of png, width, height, mask bounds (x, y, width, height), number of runs, number of rects
+MASK_THRESHOLD = 127                         # same as pygame.mask.from_surface, pixels with more alpha than this are solid
+
+
+class CompiledImage:
+    """the decoded surface and collision mask of one level image"""
+
+    def __init__(self, image: pygame.surface.Surface, mask: pygame.mask.Mask | None, mask_bounds: pygame.rect.Rect, digest: bytes,
+                 runs: numpy.ndarray, rects: numpy.ndarray):
+        self.image = image
+        self.mask = mask                    # None if it wasn't asked for, it can be made from runs
+        self.mask_bounds = mask_bounds      # rect around all the solid pixels, relative to the image
+        self.digest = digest                # sha1 of the png it was made from
+        self.runs = runs                    # the mask as runs of solid pixels, see mask_runs
+        self.rects = rects                  # big solid rects inside the mask, see collision_shape.solid_rects
+
+
+def cache_path(file_path: str) -> str:
+    folder, name = os.path.split(file_path)
+    return os.path.join(folder, CACHE_FOLDER, name + ".lvl")
+
+
+def file_digest(file_path: str) -> bytes:
+    with open(file_path, "rb") as file:
+        return hashlib.sha1(file.read()).digest()
+
+
+def alpha_masks() -> tuple[int, int, int, int]:
+    # colour masks of surfaces made by convert_alpha
+    return pygame.surface.Surface((1, 1)).convert_alpha().get_masks()
+
+
+def pixel_format() -> str:
+    # the byte order of pixels in surfaces made by convert_alpha, so cached pixels can be used without converting
+    masks = alpha_masks()
+    if masks == (0xff0000, 0xff00, 0xff, 0xff000000):
+        return "BGRA"
+    if masks == (0xff, 0xff00, 0xff0000, 0xff000000):
+        return "RGBA"
+    return "RGBA"       # anything else gets converted when loaded
+
+
+def solid_pixels(image: pygame.surface.Surface) -> numpy.ndarray:
+    # bool array indexed [y][x] of which pixels are solid
+    if image.get_flags() & pygame.SRCALPHA and image.get_bitsize() == 32:
+        alpha = pygame.surfarray.pixels_alpha(image)        # no copy, but only works with per pixel alpha
+    else:
+        alpha = pygame.surfarray.array_alpha(image)
+    solid = numpy.ascontiguousarray((alpha > MASK_THRESHOLD).T)     # alpha is indexed [x][y]
+    del alpha       # unlocks the surface
+    return solid
+
+
+def mask_runs(solid: numpy.ndarray) -> numpy.ndarray:
+    # runs of solid pixels along each row, as rows of (y, start x, end x)
+    # every row is padded with an empty pixel at both ends so its runs' starts and ends alternate, one pass over the
+    # flattened edges finds all of them
+    height, width = solid.shape
+    padded = numpy.zeros((height, width + 2), bool)
+    padded[:, 1:-1] = solid
+    edges = numpy.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    ys, starts = numpy.divmod(edges[0::2], width + 1)
+    ends = edges[1::2] - ys * (width + 1)
+    return numpy.stack((ys, starts, ends), axis=1).astype(numpy.int32)
+
+
+def mask_from_runs(runs, size: tuple[int, int]) -> pygame.mask.Mask:
+    mask = pygame.mask.Mask(size)
+    run_masks = {}      # one filled mask per run length
+    for y, start, end in runs.tolist():
+        run_mask = run_masks.get(end - start)
+        if run_mask is None:
+            run_mask = run_masks[end - start] = pygame.mask.Mask((end - start, 1), True)
+        mask.draw(run_mask, (start, y))
+    return mask
+
+
+def clip_runs(runs: numpy.ndarray, rect: pygame.rect.Rect) -> numpy.ndarray:
+    # the parts of runs inside rect, moved so rect's top left is (0, 0)
+    # runs are sorted by y so the rows inside rect can be found with a binary search
+    low, high = numpy.searchsorted(runs[:, 0], (rect.top, rect.bottom))
+    rows = runs[low:high]
+    starts = numpy.clip(rows[:, 1], rect.left, rect.right)
+    ends = numpy.clip(rows[:, 2], rect.left, rect.right)
+    keep = ends > starts
+    return numpy.stack((rows[keep, 0] - rect.top, starts[keep] - rect.left, ends[keep] - rect.left), axis=1)
+
+
+def clip_rects(rects: numpy.ndarray, rect: pygame.rect.Rect) -> numpy.ndarray:
+    # the parts of rects (rows of x, y, width, height) inside rect, moved so rect's top left is (0, 0)
+    lefts = numpy.clip(rects[:, 0], rect.left, rect.right)
+    tops = numpy.clip(rects[:, 1], rect.top, rect.bottom)
+    rights = numpy.clip(rects[:, 0] + rects[:, 2], rect.left, rect.right)
+    bottoms = numpy.clip(rects[:, 1] + rects[:, 3], rect.top, rect.bottom)
+    keep = (rights > lefts) & (bottoms > tops)
+    return numpy.stack((lefts[keep] - rect.left, tops[keep] - rect.top, (rights - lefts)[keep], (bottoms - tops)[keep]), axis=1)
+
+
+def runs_bounds(runs: numpy.ndarray) -> pygame.rect.Rect:
+    # rect around all the solid pixels
+    if len(runs) == 0:
+        return pygame.rect.Rect(0, 0, 0, 0)
+    left, right = int(runs[:, 1].min()), int(runs[:, 2].max())
+    top, bottom = int(runs[0, 0]), int(runs[-1, 0]) + 1
+    return pygame.rect.Rect(left, top, right - left, bottom - top)
+
+
+def compile_image(image: pygame.surface.Surface, digest: bytes, fmt: str) -> list[bytes]:
+    """builds the cache file contents for a decoded image (it doesn't need to be converted so this works off the main thread)
+    returns the parts of the file, they are only joined if the file can't be read back (joining copies all the pixels)"""
+    width, height = image.get_size()
+    solid = solid_pixels(image)
+    runs = mask_runs(solid)
+    rects = solid_rects(solid)
+    bounds = runs_bounds(runs)
+    header = HEADER.pack(MAGIC, VERSION, digest, width, height, bounds.x, bounds.y, bounds.width, bounds.height, len(runs), len(rects))
+    return [header, pygame.image.tobytes(image, fmt), runs.tobytes(), rects.tobytes()]
+
+
+def write_cache(file_path: str, parts: list[bytes]):
+    path = cache_path(file_path)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so a half written cache is never read
+        # (the thread id keeps two loads of the same image from writing to the same temporary file)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.writelines(parts)
+        os.replace(temp_path, path)
+    except OSError:
+        # the cache is only a speed up, the level still works without it (eg read only folders)
+        pass
+
+
+def map_cache(file_path: str) -> mmap.mmap | None:
+    try:
+        with open(cache_path(file_path), "rb") as file:
+            # copy on write so the pixels are only read from disk when used, the file can be closed straight away
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (OSError, ValueError):
+        return None
+
+
+class PreparedImage:
+    """everything about a level image except its surface, made by prepare_image on any thread"""
+
+    def __init__(self, data, digest: bytes, fmt: str, mask: pygame.mask.Mask | None):
+        magic, version, cached_digest, width, height, x, y, bounds_width, bounds_height, run_count, rect_count = HEADER.unpack_from(data)
+        view = memoryview(data)
+        pixels_end = HEADER.size + width * height * 4
+        runs_end = pixels_end + run_count * 3 * 4
+        self.size = (width, height)
+        self.pixels = view[HEADER.size:pixels_end]
+        self.pixel_format = fmt         # see pixel_format()
+        self.runs = numpy.frombuffer(view[pixels_end:runs_end], numpy.int32).reshape(run_count, 3)
+        self.rects = numpy.frombuffer(view[runs_end:], numpy.int32).reshape(rect_count, 4)
+        self.mask_bounds = pygame.rect.Rect(x, y, bounds_width, bounds_height)
+        self.digest = digest
+        self.mask = mask
+
+
+def valid_cache(data, digest: bytes) -> bool:
+    if data is None or len(data) < HEADER.size:
+        return False
+    magic, version, cached_digest, width, height, _, _, _, _, run_count, rect_count = HEADER.unpack_from(data)
+    return (magic == MAGIC and version == VERSION and cached_digest == digest
+            and len(data) == HEADER.size + width * height * 4 + run_count * 3 * 4 + rect_count * 4 * 4)
+
+
+def prepare_image(file_path: str, fmt: str, use_cache: bool=True, build_mask: bool=True, max_mask_area: int | None=None) -> PreparedImage:
+    """reads (and if needed decodes and compiles) a level image and builds its mask, unless it is bigger than max_mask_area
+
+    doesn't touch the display so it can run on a worker thread, finish_image makes the surface on the main thread"""
+    digest = file_digest(file_path)
+    data = map_cache(file_path) if use_cache else None
+    if not valid_cache(data, digest):
+        parts = compile_image(pygame.image.load(file_path), digest, fmt)
+        data = None
+        if use_cache:
+            write_cache(file_path, parts)
+            # use the memory mapped copy so the decoded pixels don't have to stay in memory
+            data = map_cache(file_path)
+        if not valid_cache(data, digest):
+            data = b"".join(parts)
+
+    prepared = PreparedImage(data, digest, fmt, None)
+    if build_mask and (max_mask_area is None or prepared.size[0] * prepared.size[1] <= max_mask_area):
+        prepared.mask = mask_from_runs(prepared.runs, prepared.size)
+    return prepared
+
+
+def finish_image(prepared: PreparedImage) -> CompiledImage:
+    # the only part of loading that has to happen on the main thread
+    image = pygame.image.frombuffer(prepared.pixels, prepared.size, prepared.pixel_format)
+    if image.get_masks() != alpha_masks():
+        image = image.convert_alpha()
+    return CompiledImage(image, prepared.mask, prepared.mask_bounds, prepared.digest, prepared.runs, prepared.rects)
+
+
+def load_image(file_path: str, use_cache: bool=True, build_mask: bool=True) -> CompiledImage:
+    """loads a level image, using the compiled cache if it is up to date and rebuilding it otherwise
+
+    without build_mask the full size mask isn't made (eg for TiledImageStage, which makes masks for each tile from runs)"""
+    return finish_image(prepare_image(file_path, pixel_format(), use_cache, build_mask))
+
+
+def load_images(file_paths: list[str], use_cache: bool=True, build_mask: bool=True, max_mask_area: int | None=None,
+                workers: int | None=None, progress=None) -> list[CompiledImage]:
+    """loads several level images at once, reading, decoding and building masks on a pool of worker threads
+
+    progress(loaded, total, file_path) is called on the main thread after each image is done
+    returns the images in the same order as file_paths"""
+    fmt = pixel_format()
+    compiled: list[CompiledImage | None] = [None] * len(file_paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(prepare_image, file_path, fmt, use_cache, build_mask, max_mask_area): i for i, file_path in enumerate(file_paths)}
+        for loaded, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            compiled[i] = finish_image(future.result())
+            if progress is not None:
+                progress(loaded, len(file_paths), file_paths[i])
+    return compiled     # type: ignore
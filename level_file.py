@@ -0,0 +1,130 @@
+import json
+import os
+
+from platforms import Platform, Rectangle, Circle, ImageStage
+from kill_area import KillArea
+from portal import Portal
+
+
+# levels made or changed in the editor are saved next to their pngs as:
+#   level.json - a snapshot, every platform, kill area and portal in the level when it was last compacted
+#   level.journal - json lines appended after the snapshot, one per edit, so saving an edit is a single small write
+# loading reads the snapshot then applies the journal, once the journal gets long it is folded into a new snapshot
+# every compaction starts a new generation, journal lines from an older generation (left by a crash part way through
+# compacting) are already in the snapshot so they are skipped
+# image stages only store their png's name and position, the images themselves go through the compiled level cache
+SNAPSHOT = "level.json"
+JOURNAL = "level.journal"
+VERSION = 1
+COMPACT_AFTER = 256     # journal entries before they are folded into the snapshot
+
+
+def encode(obj, folder: str) -> dict:
+    """the record saved for a platform, kill area or portal
+    moving platforms are saved where their path starts, not wherever they happen to be"""
+    if isinstance(obj, Portal):
+        return {"kind": "portal", "x_1": obj.x_1, "y_1": obj.y_1, "x_2": obj.x_2, "y_2": obj.y_2, "width": obj.width, "height": obj.height}
+    if isinstance(obj, KillArea):
+        return {"kind": "kill_area", "x": obj.x, "y": obj.y, "width": obj.width, "height": obj.height, "moving": obj.moving}
+
+    x, y = obj.path_start
+    if isinstance(obj, ImageStage):
+        record = {"kind": "image", "file": os.path.relpath(obj.file_path, folder), "x": x, "y": y}
+    elif isinstance(obj, Circle):
+        record = {"kind": "circle", "x": x, "y": y, "radius": obj.radius}
+    else:
+        record = {"kind": "rect" if isinstance(obj, Rectangle) else "platform", "x": x, "y": y, "width": obj.width, "height": obj.height}
+    if obj.vel_path:
+        record["vel_path"] = [[x_vel, y_vel, duration] for (x_vel, y_vel), duration in obj.vel_path]
+    return record
+
+
+def decode(record: dict, win):
+    """makes the object a record describes, apart from images (which are loaded together, see Game.load_level_from_file)"""
+    kind = record["kind"]
+    if kind == "portal":
+        return Portal((record["x_1"], record["y_1"]), (record["x_2"], record["y_2"]), (record["width"], record["height"]), win)
+    if kind == "kill_area":
+        return KillArea((record["x"], record["y"]), (record["width"], record["height"]), win, record.get("moving", False))
+
+    coords = (record["x"], record["y"])
+    vel_path = vel_path_of(record)
+    if kind == "circle":
+        return Circle(coords, record["radius"], win, vel_path)
+    if kind == "rect":
+        return Rectangle(coords, (record["width"], record["height"]), win, vel_path)
+    if kind == "platform":
+        return Platform(coords, (record["width"], record["height"]), win, vel_path)
+    raise ValueError(f"unknown level record {kind!r}")
+
+
+def vel_path_of(record: dict) -> list[tuple[tuple[float, float], float]] | None:
+    if "vel_path" not in record:
+        return None
+    return [((x_vel, y_vel), duration) for x_vel, y_vel, duration in record["vel_path"]]
+
+
+class LevelJournal:
+    """the saved copy of a level being edited, see the top of this file for the layout"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.snapshot_path = os.path.join(folder, SNAPSHOT)
+        self.journal_path = os.path.join(folder, JOURNAL)
+        self.entries = 0        # lines in the journal
+        self.generation = 0
+        self.file = None        # journal, kept open for appending
+
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_path)
+
+    def load(self) -> list[dict]:
+        """every record in the level, in the order they were added"""
+        with open(self.snapshot_path) as file:
+            snapshot = json.load(file)
+        if snapshot.get("version") != VERSION:
+            raise ValueError(f"{self.snapshot_path} was saved by a different version")
+        records = snapshot["objects"]
+        self.generation = snapshot["generation"]
+
+        self.entries = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break       # a half written last line from a crash, everything before it is still fine
+                    if entry["generation"] != self.generation:
+                        continue
+                    if entry["op"] == "add":
+                        records.append(entry["object"])
+                    self.entries += 1
+        return records
+
+    def append(self, obj):
+        # saves one edit, just a line on the end of the journal
+        if self.file is None:
+            self.file = open(self.journal_path, "a")
+        entry = {"op": "add", "generation": self.generation, "object": encode(obj, self.folder)}
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.file.flush()
+        self.entries += 1
+
+    def compact(self, objects: list):
+        """writes a new snapshot of objects and empties the journal
+        the snapshot is written to a temporary file first so a crash part way through can't lose the level"""
+        self.close()
+        self.generation += 1
+        temporary_path = self.snapshot_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"version": VERSION, "generation": self.generation, "objects": [encode(obj, self.folder) for obj in objects]}, file, separators=(",", ":"))
+        os.replace(temporary_path, self.snapshot_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.entries = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,59 @@
+import os
+import time
+
+from level_cache import file_digest
+
+
+class LevelWatcher:
+    """polls a level folder for pngs that have been changed, added or removed, for reloading art without restarting
+
+    the folder is only listed every interval seconds, files whose modification time or size changed are hashed so
+    saving an image without changing it doesn't cause a reload"""
+
+    def __init__(self, folder: str, interval: float=0.5):
+        self.folder = folder
+        self.interval = interval
+        self.last_poll = time.perf_counter()
+        self.files = self.scan()        # path -> (modification time, size)
+        self.digests = {path: file_digest(path) for path in self.files}
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        files = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    files[f"{self.folder}/{entry.name}"] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def poll(self, force: bool=False) -> tuple[list[str], list[str], list[str]]:
+        """returns the paths of the pngs changed, added and removed since the last poll
+        does nothing (returns empty lists) if it was less than interval seconds ago unless forced"""
+        now = time.perf_counter()
+        if not force and now - self.last_poll < self.interval:
+            return [], [], []
+        self.last_poll = now
+
+        files = self.scan()
+        changed = []
+        for path, stat in files.items():
+            old = self.files.get(path)
+            if old is None or old == stat:
+                continue
+            digest = file_digest(path)
+            if digest != self.digests.get(path):
+                changed.append(path)
+            self.digests[path] = digest
+        added = [path for path in files if path not in self.files]
+        for path in added:
+            self.digests[path] = file_digest(path)
+        removed = [path for path in self.files if path not in files]
+        for path in removed:
+            self.digests.pop(path, None)
+        self.files = files
+        return changed, added, removed
+
+    def retry(self, path: str):
+        # reports path again next poll (as added) eg if it couldn't be loaded because it was only half written
+        self.files.pop(path, None)
+        self.digests.pop(path, None)
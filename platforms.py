@@ -2,26 +2,40 @@ import pygame
 import math
 
 from consts import *
+from level_cache import CompiledImage, load_image, clip_runs, clip_rects, mask_from_runs, mask_runs, solid_pixels
+from tile_cache import TileCache
+from collision_shape import EMPTY, FULL, MaskShape, CachedRect, filled_mask, solid_rects, sweep_area
+
+
+# reused for the rects made while testing collisions, so tests don't make new rects
+probe_rect = pygame.rect.Rect(0, 0, 0, 0)
+swept_rect = pygame.rect.Rect(0, 0, 0, 0)
+candidate_rect = pygame.rect.Rect(0, 0, 0, 0)
 
 
 class Platform:
+    __slots__ = ("x", "y", "width", "height", "win", "path_start", "path_time", "vel_path", "has_rect", "mask", "shape",
+                 "cached_rect", "cached_bounds", "cached_screen_rect")
+    
     def __init__(self, coords: tuple[float, float], dims, win: pygame.surface.Surface, vel_path: list[tuple[tuple[float, float], float]] | None=None):
         self.x, self.y = coords
         self.width, self.height = dims
         self.win = win
-        self.vel_pointer = 0
-        self.time_since_vel_change = 0
+        self.cached_rect, self.cached_bounds, self.cached_screen_rect = CachedRect(), CachedRect(), CachedRect()
+        self.path_start = (self.x, self.y)     # where vel_path starts from
+        self.path_time = 0.0                    # seconds along vel_path the platform is
         if vel_path is None:
             self.vel_path: list[tuple[tuple[float, float], float]] = []
         else:
             self.vel_path: list[tuple[tuple[float, float], float]] = vel_path # type: ignore
         self.has_rect = True
         self.mask = pygame.mask.Mask((0, 0))
+        self.shape: MaskShape | None = None     # mask split into solid rects for faster collisions, if the platform has a mask
     
     @property
     def rect(self) -> pygame.rect.Rect:
-        # actual rect used for collisions
-        return pygame.rect.Rect(self.x, self.y, self.width, self.height)
+        # actual rect used for collisions (the same rect every time, only changed when the platform moves, so don't keep it)
+        return self.cached_rect.get(self.x, self.y, self.width, self.height)
     
     @property
     def x_tl(self):
@@ -31,70 +45,190 @@ class Platform:
     def y_tl(self):
         return self.y
     
+    @property
+    def bounds(self) -> pygame.rect.Rect:
+        # rect containing everything the platform could collide with, used by the broadphase
+        return self.rect
+    
     def screen_rect(self, screen_coords) -> pygame.rect.Rect:
         # rect with regard to the coordinates (top left) of the screen so is used to draw
-        return pygame.rect.Rect(self.x - screen_coords[0], self.y - screen_coords[1], self.width, self.height)
+        return self.cached_screen_rect.get(self.x - screen_coords[0], self.y - screen_coords[1], self.width, self.height)
+    
+    def collide_rect(self, rect: pygame.rect.Rect) -> bool:
+        # whether a solid rect (eg the player) at these coordinates overlaps the platform
+        if self.has_rect:
+            return self.rect.colliderect(rect)
+        offset_x = rect.x - self.x_tl
+        offset_y = rect.y - self.y_tl
+        if self.shape is not None:
+            probe_rect.update(offset_x, offset_y, rect.width, rect.height)
+            return self.shape.collide_rect(probe_rect)
+        return bool(self.mask.overlap(filled_mask(rect.size), (offset_x, offset_y)))
 
-    def draw(self, screen_coords):
-        pygame.draw.rect(self.win, pygame.Color("black"), self.screen_rect(screen_coords))
+    def sweep(self, rect: pygame.rect.Rect, distance: int, vertical: bool=False) -> int | None:
+        """moves rect distance pixels along one axis, returns how many pixels it moves before it first overlaps the platform
+        (so it can move one less than that) or None if the whole path is clear"""
+        if distance == 0:
+            return None
+        swept = sweep_area(rect, distance, vertical, swept_rect)
+        
+        if self.has_rect:
+            other = self.rect
+            if not swept.colliderect(other):
+                return None
+            if vertical:
+                steps = other.top - rect.bottom + 1 if distance > 0 else rect.top - other.bottom + 1
+            else:
+                steps = other.left - rect.right + 1 if distance > 0 else rect.left - other.right + 1
+            return max(steps, 1)
         
-    def tick(self, player, dt):
-        self.time_since_vel_change += dt
-        if len(self.vel_path) == 0:
-            x_vel = y_vel = 0
+        # find the solid pixels inside the swept area, the closest one to the start is the first contact
+        hit = self.solid_in(swept)
+        if hit is None:
+            return None
+        if vertical:
+            steps = hit.top - rect.height + 1 if distance > 0 else -distance - hit.bottom + 1
         else:
-            if self.time_since_vel_change > self.vel_path[self.vel_pointer][1]:
-                next_pointer = self.vel_pointer + 1
-                if next_pointer > len(self.vel_path) - 1:
-                    next_pointer = 0
-                self.vel_pointer = next_pointer
-                self.time_since_vel_change = 0
-            x_vel, y_vel = self.vel_path[self.vel_pointer][0]
+            steps = hit.left - rect.width + 1 if distance > 0 else -distance - hit.right + 1
+        return max(steps, 1)
+
+    def solid_in(self, area: pygame.rect.Rect) -> pygame.rect.Rect | None:
+        # rect around the solid pixels of the mask inside area, relative to area's top left
+        if self.shape is not None:
+            # empty and completely solid areas don't need the pixels, finding the bounding rects of an overlap is slow
+            probe_rect.update(area.x - self.x_tl, area.y - self.y_tl, area.width, area.height)
+            occupancy = self.shape.pyramid.occupancy(probe_rect)
+            if occupancy == EMPTY:
+                return None
+            if occupancy == FULL:
+                hit = probe_rect.clip(self.shape.pyramid.rect)
+                hit.x -= probe_rect.x
+                hit.y -= probe_rect.y
+                return hit
+        overlap = filled_mask(area.size).overlap_mask(self.mask, (self.x_tl - area.x, self.y_tl - area.y))
+        hit_rects = overlap.get_bounding_rects()
+        if not hit_rects:
+            return None
+        return hit_rects[0].unionall(hit_rects[1:])
+
+    def clear_tops(self, rect: pygame.rect.Rect, tops: list[int], clear: list[bool]):
+        """sets clear[i] to False if rect moved so its top is at tops[i] would overlap the platform
+        for trying a few heights at once, eg stepping up slopes or getting unstuck"""
+        if self.has_rect:
+            other = self.rect
+            if not (other and rect) or rect.right <= other.left or rect.left >= other.right:
+                return
+            for i, top in enumerate(tops):
+                if top < other.bottom and top + rect.height > other.top:
+                    clear[i] = False
+            return
+        if self.shape is not None:
+            # offsets are truncated the same way collide_rect's are
+            y_tl = self.y_tl
+            self.shape.clear_tops(int(rect.x - self.x_tl), rect.width, rect.height, [int(top - y_tl) for top in tops], clear)
+            return
+        for i, top in enumerate(tops):
+            if clear[i]:
+                candidate_rect.update(rect.x, top, rect.width, rect.height)
+                if self.collide_rect(candidate_rect):
+                    clear[i] = False
+
+    def draw(self, screen_coords, surface: pygame.surface.Surface | None=None):
+        # draws onto the window unless given another surface (eg a chunk of the static layer)
+        pygame.draw.rect(self.win if surface is None else surface, pygame.Color("black"), self.screen_rect(screen_coords))
         
-        self.x += x_vel * dt
-        self.y += y_vel * dt
+    @property
+    def path_loop(self) -> tuple[float, float, float]:
+        # (seconds to go round vel_path once, x moved, y moved in that time)
+        period = dx = dy = 0
+        for (x_vel, y_vel), duration in self.vel_path:
+            period += duration
+            dx += x_vel * duration
+            dy += y_vel * duration
+        return period, dx, dy
+    
+    def path_position(self, path_time: float) -> tuple[float, float]:
+        """where the platform is path_time seconds after starting vel_path, worked out directly from the time
+        so it doesn't drift however it is stepped"""
+        x, y = self.path_start
+        period, dx, dy = self.path_loop
+        if period <= 0:
+            return x, y
+        loops, path_time = divmod(path_time, period)
+        x += loops * dx
+        y += loops * dy
+        for (x_vel, y_vel), duration in self.vel_path:
+            part = min(path_time, duration)
+            x += x_vel * part
+            y += y_vel * part
+            path_time -= part
+            if path_time <= 0:
+                break
+        return x, y
+    
+    def path_bounds(self) -> pygame.rect.Rect | None:
+        # everywhere the platform can be while following vel_path, or None if it doesn't come back to where it started
+        period, dx, dy = self.path_loop
+        if dx or dy:
+            return None
+        x, y = self.x, self.y
+        bounds = self.bounds.copy()
+        path_time = 0.0
+        for _, duration in self.vel_path:
+            path_time += duration
+            self.x, self.y = self.path_position(path_time)
+            bounds.union_ip(self.bounds)
+        self.x, self.y = x, y
+        return bounds
+    
+    def move_to(self, path_time: float, player=None, broadphase=None):
+        # moves the platform along vel_path to path_time, taking the player with it if they are on it
+        old_x, old_y = self.x, self.y
+        self.path_time = path_time
+        self.x, self.y = self.path_position(path_time)
+        dx, dy = self.x - old_x, self.y - old_y
+        if not (dx or dy):
+            return
         
-        player_collide = False
-        if self == player.platform_touching:
-            player_collide = True
-        elif self.has_rect:
-            rect = self.rect
-            #rect.x += 1
-            #rect.y += 1
-            #rect.width -= 2
-            #rect.height -= 2
-            player_collide = rect.colliderect(player.rect)
-        else:
-            offset_x = player.x - self.x_tl
-            offset_y = player.y - self.y_tl
-            player_collide = self.mask.overlap(player.mask, (offset_x, offset_y))
+        if broadphase is not None:
+            broadphase.update(self)
         
-        if player_collide:
-            player.x += x_vel * dt
-            player.y += y_vel * dt
+        if player is not None and (self == player.platform_touching or self.collide_rect(player.rect)):
+            player.x += dx
+            player.y += dy
+    
+    def tick(self, player, dt, broadphase=None):
+        self.move_to(self.path_time + dt, player, broadphase)
 
 
 class Rectangle(Platform):
+    __slots__ = ()
+    
     def __init__(self, coords: tuple[float, float], dims, win: pygame.surface.Surface, vel_path: list[tuple[tuple[float, float], float]] | None=None):
         self.x, self.y = coords
         self.width, self.height = dims
         self.win = win
-        self.vel_pointer = 0
-        self.time_since_vel_change = 0
+        self.cached_rect, self.cached_bounds, self.cached_screen_rect = CachedRect(), CachedRect(), CachedRect()
+        self.path_start = (self.x, self.y)     # where vel_path starts from
+        self.path_time = 0.0                    # seconds along vel_path the platform is
         if vel_path is None:
             self.vel_path: list[tuple[tuple[float, float], float]] = []
         else:
             self.vel_path: list[tuple[tuple[float, float], float]] = vel_path # type: ignore
         self.has_rect = True
+        self.shape = None
         
         
 class Circle(Platform):
+    __slots__ = ("radius",)
+    
     def __init__(self, coords: tuple[float, float], radius: float, win: pygame.surface.Surface, vel_path: list[tuple[tuple[float, float], float]] | None=None):
         self.x, self.y = coords
         self.radius = radius
         self.win = win
-        self.vel_pointer = 0
-        self.time_since_vel_change = 0
+        self.cached_rect, self.cached_bounds, self.cached_screen_rect = CachedRect(), CachedRect(), CachedRect()
+        self.path_start = (self.x, self.y)     # where vel_path starts from
+        self.path_time = 0.0                    # seconds along vel_path the platform is
         if vel_path is None:
             self.vel_path: list[tuple[tuple[float, float], float]] = []
         else:
@@ -103,6 +237,8 @@ class Circle(Platform):
         circle_surface = pygame.Surface((self.radius * 2, self.radius * 2), pygame.SRCALPHA)
         pygame.draw.circle(circle_surface, pygame.Color("black"), (self.radius, self.radius), self.radius)
         self.mask = pygame.mask.from_surface(circle_surface)
+        solid = solid_pixels(circle_surface)
+        self.shape = MaskShape(self.mask, solid_rects(solid), mask_runs(solid))
         
     @property
     def x_tl(self):
@@ -111,28 +247,171 @@ class Circle(Platform):
     @property
     def y_tl(self):
         return self.y - self.radius
+    
+    @property
+    def bounds(self) -> pygame.rect.Rect:
+        return self.cached_bounds.get(self.x_tl, self.y_tl, self.radius * 2, self.radius * 2)
 
-    def draw(self, screen_coords):
-        if (screen_coords[0] <= self.x and self.x - self.radius <= screen_coords[0] + WIDTH) \
-            and (screen_coords[1] <= self.y + self.radius and self.y - self.radius <= screen_coords[1] + HEIGHT):
-            pygame.draw.circle(self.win, pygame.Color("black"), (self.x - screen_coords[0], self.y - screen_coords[1]), self.radius)
+    def draw(self, screen_coords, surface: pygame.surface.Surface | None=None):
+        pygame.draw.circle(self.win if surface is None else surface, pygame.Color("black"), (self.x - screen_coords[0], self.y - screen_coords[1]), self.radius)
         
         
 class ImageStage(Platform):
-    def __init__(self, file_path: str, win: pygame.surface.Surface, coords: tuple[int, int]=(0, 0), vel_path: list[tuple[tuple[float, float], float]] | None=None):
+    __slots__ = ("file_path", "image")
+    
+    def __init__(self, file_path: str, win: pygame.surface.Surface, coords: tuple[int, int]=(0, 0), vel_path: list[tuple[tuple[float, float], float]] | None=None,
+                 compiled: CompiledImage | None=None):
+        self.file_path = file_path
         self.x, self.y = coords
         self.win = win
-        self.image = pygame.image.load(file_path).convert_alpha()
-        self.mask = pygame.mask.from_surface(self.image)
+        self.cached_rect, self.cached_bounds, self.cached_screen_rect = CachedRect(), CachedRect(), CachedRect()
+        if compiled is None:
+            # goes through the compiled level cache so the png only has to be decoded when it changes
+            compiled = load_image(file_path)
+        self.image = compiled.image
+        self.mask = compiled.mask
+        if self.mask is None:
+            self.mask = mask_from_runs(compiled.runs, self.image.get_size())
+        self.shape = MaskShape(self.mask, compiled.rects, compiled.runs)
         self.has_rect = False
-        self.vel_pointer = 0
-        self.time_since_vel_change = 0
+        self.path_start = (self.x, self.y)     # where vel_path starts from
+        self.path_time = 0.0                    # seconds along vel_path the platform is
         if vel_path is None:
             self.vel_path: list[tuple[tuple[float, float], float]] = []
         else:
             self.vel_path: list[tuple[tuple[float, float], float]] = vel_path # type: ignore
+    
+    @property
+    def bounds(self) -> pygame.rect.Rect:
+        return self.cached_bounds.get(self.x, self.y, self.image.get_width(), self.image.get_height())
 
-    def draw(self, screen_coords):
+    def draw(self, screen_coords, surface: pygame.surface.Surface | None=None):
+        # only blit the part of the image that is on the screen
+        surface = self.win if surface is None else surface
         rect = self.image.get_rect()
         rect.x, rect.y = self.x - screen_coords[0], self.y - screen_coords[1]
-        self.win.blit(self.image, rect)
+        area = self.image.get_rect().clip(pygame.rect.Rect((-rect.x, -rect.y), surface.get_size()))
+        if area.width and area.height:
+            surface.blit(self.image, (rect.x + area.x, rect.y + area.y), area)
+
+
+class Tile:
+    __slots__ = ("image", "mask", "shape")
+    
+    def __init__(self, image: pygame.surface.Surface, mask: pygame.mask.Mask, shape: MaskShape):
+        self.image = image
+        self.mask = mask
+        self.shape = shape
+
+
+class TiledImageStage(ImageStage):
+    """an ImageStage split into tiles that are only loaded when something near them needs them,
+    so huge images don't have to have their whole surface and mask in memory
+
+    tiles are kept in a TileCache shared between stages, which evicts them under a memory budget
+    the image is read from the memory mapped level cache so unused tiles don't take up memory"""
+    
+    __slots__ = ("runs", "rects", "tile_cache", "tile_size", "tiles_x", "tiles_y", "solid_tiles")
+
+    def __init__(self, file_path: str, win: pygame.surface.Surface, tile_cache: TileCache, coords: tuple[int, int]=(0, 0),
+                 vel_path: list[tuple[tuple[float, float], float]] | None=None, compiled: CompiledImage | None=None, tile_size: int=TILE_SIZE):
+        self.file_path = file_path
+        self.x, self.y = coords
+        self.win = win
+        self.cached_rect, self.cached_bounds, self.cached_screen_rect = CachedRect(), CachedRect(), CachedRect()
+        if compiled is None:
+            compiled = load_image(file_path, build_mask=False)
+        self.image = compiled.image         # whole image, only read from when a tile is loaded
+        self.runs = compiled.runs
+        self.rects = compiled.rects
+        self.mask = pygame.mask.Mask((0, 0))
+        self.shape = None
+        self.has_rect = False
+        self.path_start = (self.x, self.y)     # where vel_path starts from
+        self.path_time = 0.0                    # seconds along vel_path the platform is
+        if vel_path is None:
+            self.vel_path: list[tuple[tuple[float, float], float]] = []
+        else:
+            self.vel_path: list[tuple[tuple[float, float], float]] = vel_path # type: ignore
+        
+        self.tile_cache = tile_cache
+        self.tile_size = tile_size
+        width, height = self.image.get_size()
+        self.tiles_x = (width + tile_size - 1) // tile_size
+        self.tiles_y = (height + tile_size - 1) // tile_size
+        self.solid_tiles = self.find_solid_tiles()
+    
+    def find_solid_tiles(self) -> set[tuple[int, int]]:
+        # tiles with at least one solid pixel, the rest never need loading for collisions
+        solid = set()
+        size = self.tile_size
+        for y, start, end in self.runs.tolist():
+            tile_y = y // size
+            for tile_x in range(start // size, (end - 1) // size + 1):
+                solid.add((tile_x, tile_y))
+        return solid
+    
+    def tile_rect(self, tile_x: int, tile_y: int) -> pygame.rect.Rect:
+        # area of the tile in the image
+        size = self.tile_size
+        return pygame.rect.Rect(tile_x * size, tile_y * size, size, size).clip(self.image.get_rect())
+    
+    def load_tile(self, tile_x: int, tile_y: int) -> tuple[Tile, int]:
+        rect = self.tile_rect(tile_x, tile_y)
+        image = self.image.subsurface(rect).copy()
+        runs = clip_runs(self.runs, rect)
+        mask = mask_from_runs(runs, rect.size)
+        return Tile(image, mask, MaskShape(mask, clip_rects(self.rects, rect), runs)), rect.width * rect.height * 4 + rect.width * rect.height // 4
+    
+    def tile(self, tile_x: int, tile_y: int) -> Tile:
+        return self.tile_cache.get((id(self), tile_x, tile_y), lambda: self.load_tile(tile_x, tile_y))
+    
+    def tiles_in(self, rect: pygame.rect.Rect):
+        # (tile x, tile y, tile's top left in level coordinates) of every tile overlapping rect (level coordinates)
+        size = self.tile_size
+        left, top = rect.left - self.x, rect.top - self.y
+        x_start, x_end = max(int(left // size), 0), min(int((left + rect.width - 1) // size), self.tiles_x - 1)
+        y_start, y_end = max(int(top // size), 0), min(int((top + rect.height - 1) // size), self.tiles_y - 1)
+        for tile_y in range(y_start, y_end + 1):
+            for tile_x in range(x_start, x_end + 1):
+                yield tile_x, tile_y, (self.x + tile_x * size, self.y + tile_y * size)
+    
+    def prefetch(self, rect: pygame.rect.Rect):
+        # load the tiles in rect before they are needed
+        for tile_x, tile_y, _ in self.tiles_in(rect):
+            self.tile(tile_x, tile_y)
+    
+    def collide_rect(self, rect: pygame.rect.Rect) -> bool:
+        for tile_x, tile_y, (x, y) in self.tiles_in(rect):
+            if (tile_x, tile_y) not in self.solid_tiles:
+                continue
+            probe_rect.update(rect.x - x, rect.y - y, rect.width, rect.height)
+            if self.tile(tile_x, tile_y).shape.collide_rect(probe_rect):
+                return True
+        return False
+
+    def solid_in(self, area: pygame.rect.Rect) -> pygame.rect.Rect | None:
+        area_mask = None
+        hit = None
+        for tile_x, tile_y, (x, y) in self.tiles_in(area):
+            if (tile_x, tile_y) not in self.solid_tiles:
+                continue
+            tile = self.tile(tile_x, tile_y)
+            probe_rect.update(area.x - x, area.y - y, area.width, area.height)
+            if tile.shape.pyramid.occupancy(probe_rect) == EMPTY:
+                continue
+            if area_mask is None:
+                area_mask = filled_mask(area.size)
+            overlap = area_mask.overlap_mask(tile.mask, (x - area.x, y - area.y))
+            for rect in overlap.get_bounding_rects():
+                hit = rect if hit is None else hit.union(rect)
+        return hit
+    
+    def draw(self, screen_coords, surface: pygame.surface.Surface | None=None):
+        surface = self.win if surface is None else surface
+        view = pygame.rect.Rect(screen_coords, surface.get_size())
+        for tile_x, tile_y, (x, y) in self.tiles_in(view):
+            tile = self.tile(tile_x, tile_y)
+            rect = tile.image.get_rect()
+            rect.x, rect.y = x - screen_coords[0], y - screen_coords[1]
+            surface.blit(tile.image, rect)
@@ -1,12 +1,22 @@
 import pygame
+import math
 
 from consts import *
 from platforms import Platform, Rectangle, Circle, ImageStage
-from kill_area import KillArea
 from portal import Portal
+from broadphase import SpatialGrid
+from triggers import TriggerLayer
+from collision_shape import CachedRect, filled_mask, sweep_area
 
 
 class Player:
+    # slots make attribute access a bit faster and stop typos making new attributes
+    __slots__ = ("win", "width", "height", "mass", "friction", "x_accel", "x_accel_air_mod", "terminal_x_vel", "terminal_y_vel",
+                 "wall_slide_vel", "gravity", "jump_strength", "coyote_time", "dash_strength", "dash_length", "dash_cooldown",
+                 "swept_collision", "max_substep", "deaths", "x", "y", "x_vel", "y_vel", "right", "left", "up", "down", "jumping",
+                 "time_since_dash", "time_since_jump", "time_since_touched_floor", "time_since_touched_wall", "wall_jump_dir",
+                 "wall_jumping", "platform_touching", "in_portal", "triggers_inside", "cached_rect", "cached_screen_rect", "probe_rect", "swept_rect")
+    
     def __init__(self, win: pygame.surface.Surface):
         self.win = win
         
@@ -29,8 +39,18 @@ class Player:
         self.dash_length = 0.06
         self.dash_cooldown = 0.8
         
-        self.recording = False
-        self.recorded_coords = []
+        # move straight to the first contact instead of splitting movement into steps, off by default since divided steps
+        # are the original physics (and what batch_sim reproduces)
+        self.swept_collision = False
+        self.max_substep = 1              # furthest the player moves in one step when not using swept collision
+        
+        self.deaths = 0         # times the player has been killed or got stuck, useful for headless runs
+        
+        # collision rects are reused instead of making new ones every test
+        self.cached_rect = CachedRect()
+        self.cached_screen_rect = CachedRect()
+        self.probe_rect = pygame.rect.Rect(0, 0, self.width, self.height)      # for testing positions the player isn't at
+        self.swept_rect = pygame.rect.Rect(0, 0, 0, 0)                         # area covered by a sweep
         
         self.reset()
     
@@ -56,15 +76,16 @@ class Player:
         
         self.platform_touching = None
         self.in_portal = False
+        self.triggers_inside: dict = {}     # trigger volumes the player was in at the last trigger update
 
     @property
     def rect(self) -> pygame.rect.Rect:
-        # actual rect used for collisions
-        return pygame.rect.Rect(self.x, self.y, self.width, self.height)
+        # actual rect used for collisions (the same rect every time, only changed when the player moves, so don't keep it)
+        return self.cached_rect.get(self.x, self.y, self.width, self.height)
     
     @property
     def mask(self):
-        return pygame.mask.Mask((self.width, self.height), True)
+        return filled_mask((self.width, self.height))      # shared, don't draw on it
     
     @property
     def can_jump(self) -> bool:
@@ -80,7 +101,7 @@ class Player:
     
     def screen_rect(self, screen_coords) -> pygame.rect.Rect:
         # rect with regard to the coordinates (top left) of the screen so is used to draw
-        return pygame.rect.Rect(self.x - screen_coords[0], self.y - screen_coords[1], self.width, self.height)
+        return self.cached_screen_rect.get(self.x - screen_coords[0], self.y - screen_coords[1], self.width, self.height)
 
     def draw(self, screen_coords):
         # use screen rect
@@ -144,105 +165,226 @@ class Player:
         self.x_vel = self.dash_strength * sign
         self.time_since_dash = 0
     
-    def check_in_portal(self, portals: list[Portal]):
-        collide_portal = False
-        for portal in portals:
-            if self.rect.colliderect(portal.rect_1):
-                collide_portal = True
-                if not self.in_portal:
-                    # wasn't in a portal before but now is
-                    if portal.vertical:
-                        self.y = portal.y_2 + self.y - portal.y_1
-                        if self.x > portal.x_1:
-                            self.x = portal.x_2 - self.width
-                        else:
-                            self.x = portal.x_2 + portal.width
-                    else:
-                        self.x = portal.x_2 + self.x - portal.x_1
-                        if self.y > portal.y_1:
-                            self.y = portal.y_2 - self.height
-                        else:
-                            self.y = portal.y_2 + portal.height
-                    self.in_portal = True
-                
-            elif self.rect.colliderect(portal.rect_2):
-                collide_portal = True
-                #print("in orange")
-                if not self.in_portal:
-                    # wasn't in a portal before but now is
-                    if portal.vertical:
-                        self.y = portal.y_1 + self.y - portal.y_2
-                        if self.x > portal.x_2:
-                            self.x = portal.x_1 - self.width
-                        else:
-                            self.x = portal.x_1 + portal.width
-                    else:
-                        self.x = portal.x_1 + self.x - portal.x_2
-                        if self.y > portal.y_2:
-                            self.y = portal.y_1 - self.height
-                        else:
-                            self.y = portal.y_1 + portal.height
-                    self.in_portal = True
-        
-        if not collide_portal:
+    def check_triggers(self, triggers: TriggerLayer):
+        # sends enter/stay/exit events to the triggers (portals teleport the player when entered)
+        triggers.update(self)
+        if self.in_portal and not any(isinstance(volume.trigger, Portal) for volume in self.triggers_inside.values()):
             self.in_portal = False
     
-    def touching(self, platforms: list[Platform], kill_areas: list[KillArea], portals: list[Portal]):
+    def touching(self, platforms: SpatialGrid, triggers: TriggerLayer):
         """returns "dead" if dead, otherwise True or False whether position is valid or not"""
         
-        if self.rect.collidelist([kill_area.rect for kill_area in kill_areas]) != -1:
+        rect = self.rect
+        if triggers.lethal(rect):
             return "dead"
         
-        other_platforms = []
-        for platform in platforms:
-            if platform.has_rect:
-                if self.rect.colliderect(platform.rect):
-                    return platform
-            else:
-                offset_x = self.x - platform.x_tl
-                offset_y = self.y - platform.y_tl
-                if platform.mask.overlap(self.mask, (offset_x, offset_y)):
-                    return platform
+        # only test the platforms the broadphase says are near the player
+        platform = self.collide_platforms(platforms, rect)
+        if platform is not None:
+            return platform
         
         return -1
     
-    def update_position(self, platforms: list[Platform], kill_areas: list[KillArea], portals: list[Portal], dt):
+    def hit_wall(self):
+        self.wall_jump_dir = 0 if self.x_vel == 0 else - int(self.x_vel / abs(self.x_vel))
+        self.time_since_touched_wall = 0
+        self.x_vel = 0
+        if self.dashing:
+            self.time_since_dash = self.dash_length       # if wall is hit, stop dashing
+        self.y_vel = min(self.y_vel, self.wall_slide_vel)      # slide down walls
+    
+    def collide_platforms(self, platforms: SpatialGrid, rect: pygame.rect.Rect):
+        # returns the first platform overlapping rect or None
+        for platform in platforms.query(rect):
+            if platform.collide_rect(rect):
+                return platform
+        return None
+    
+    def first_clear(self, platforms: SpatialGrid, triggers: TriggerLayer, x: float, heights: list[float]) -> int | None:
+        """the index of the first of heights the player could move to (at x) without overlapping a platform or anything
+        lethal, or None if there isn't one
+        the platforms near them are found once and each one checks every height at once (see Platform.clear_tops)"""
+        probe = self.probe_rect
+        tops = []
+        for y in heights:
+            probe.update(x, y, self.width, self.height)
+            tops.append(probe.top)
+        area = self.swept_rect
+        area.update(probe.x, min(tops), self.width, max(tops) - min(tops) + self.height)
+        clear = [True] * len(tops)
+        for platform in platforms.query(area):
+            platform.clear_tops(probe, tops, clear)
+            if not any(clear):
+                return None
+        for i, y in enumerate(heights):
+            if clear[i]:
+                probe.update(x, y, self.width, self.height)
+                if not triggers.lethal(probe):
+                    return i
+        return None
+    
+    def sweep_platforms(self, platforms: SpatialGrid, rect: pygame.rect.Rect, distance: int, vertical: bool):
+        # returns the first platform hit when moving rect distance pixels along one axis and how many pixels until it is hit
+        swept = sweep_area(rect, distance, vertical, self.swept_rect)
+        first, first_steps = None, None
+        for platform in platforms.query(swept):
+            steps = platform.sweep(rect, distance, vertical)
+            if steps is not None and (first_steps is None or steps < first_steps):
+                first, first_steps = platform, steps
+        return first, first_steps
+    
+    def first_trigger(self, triggers: TriggerLayer, rect: pygame.rect.Rect, distance: int, vertical: bool) -> int | None:
+        """how many pixels rect moves along one axis before it first overlaps a trigger volume the player isn't already in,
+        or None if it doesn't (lethal volumes are left to triggers.lethal)"""
+        if len(triggers) == triggers.lethal_count:
+            return None
+        inside = self.triggers_inside
+        first = None
+        for volume in triggers.overlapping(sweep_area(rect, distance, vertical, self.swept_rect)):
+            if volume.trigger.lethal or id(volume) in inside:
+                continue
+            bounds = volume.bounds
+            if vertical:
+                steps = bounds.top - rect.bottom + 1 if distance > 0 else rect.top - bounds.bottom + 1
+            else:
+                steps = bounds.left - rect.right + 1 if distance > 0 else rect.left - bounds.right + 1
+            steps = max(steps, 0)
+            if first is None or steps < first:
+                first = steps
+        return first
+    
+    def enter_trigger(self, triggers: TriggerLayer, position: int, vertical: bool, target: float) -> float:
+        """moves the player to where a sweep first entered a trigger (position along the axis, in whole pixels) and sends
+        the events there, so passing through a portal in one tick still goes through it from the right side
+        returns where the rest of the move now ends (it carries on from wherever the events left the player)"""
+        if vertical:
+            if position != int(self.y):
+                self.y = position
+            remaining = target - self.y
+            self.check_triggers(triggers)
+            return self.y + remaining
+        if position != int(self.x):
+            self.x = position
+        remaining = target - self.x
+        self.check_triggers(triggers)
+        return self.x + remaining
+    
+    def update_position_swept(self, platforms: SpatialGrid, triggers: TriggerLayer, dt):
+        # moves the whole way along x then y, only stopping at the first thing hit
+        # so the amount of collision work depends on how many things are hit rather than a fixed number of steps
+        self.check_triggers(triggers)
+        
+        if self.y_vel > 0:
+            # standing on something, land before moving sideways so slopes can be walked up
+            # (the row under the player is one overlap test, a sweep one pixel down can only ever hit at the first pixel)
+            hit = self.collide_platforms(platforms, sweep_area(self.rect, 1, True, self.swept_rect))
+            if hit is not None:
+                self.platform_touching = hit
+                self.time_since_touched_floor = 0
+                self.y_vel = 0
+        
+        target_x = self.x + self.x_vel * dt
+        sign = 1 if self.x_vel > 0 else -1
+        while True:
+            distance = int(target_x) - int(self.x)
+            rect = self.rect
+            if distance == 0:
+                self.x = target_x
+                break
+            hit, steps = self.sweep_platforms(platforms, rect, distance, False)
+            # only the part of the sweep before the platform is travelled, anything lethal behind it can't be reached
+            reach = distance if hit is None else sign * (steps - 1)
+            if triggers.lethal(sweep_area(rect, reach, False, self.swept_rect)):
+                return "dead"
+            entered = self.first_trigger(triggers, rect, reach, False)
+            if entered is not None:
+                target_x = self.enter_trigger(triggers, rect.x + sign * entered, False, target_x)
+                continue
+            if hit is None:
+                self.x = target_x
+                break
+            
+            contact_x = rect.x + sign * steps
+            if abs(self.y_vel) <= 1 or self.x_vel >= self.terminal_x_vel:
+                # moving up slopes, step up onto whatever was hit if there is room
+                step = self.first_clear(platforms, triggers, contact_x, [self.y - i for i in range(1, 6)])
+                if step is not None:
+                    self.x = contact_x
+                    self.y -= step + 1
+                    continue
+            
+            if steps > 1:
+                self.x = contact_x - sign
+            self.hit_wall()
+            break
+        
+        target_y = self.y + self.y_vel * dt
+        while True:
+            distance = int(target_y) - int(self.y)
+            if distance == 0:
+                self.y = target_y
+                break
+            rect = self.rect
+            sign = 1 if distance > 0 else -1
+            hit, steps = self.sweep_platforms(platforms, rect, distance, True)
+            reach = distance if hit is None else sign * (steps - 1)
+            if triggers.lethal(sweep_area(rect, reach, True, self.swept_rect)):
+                return "dead"
+            entered = self.first_trigger(triggers, rect, reach, True)
+            if entered is not None:
+                target_y = self.enter_trigger(triggers, rect.y + sign * entered, True, target_y)
+                continue
+            if hit is None:
+                self.y = target_y
+            else:
+                if steps > 1:
+                    self.y = rect.y + (steps - 1) * sign
+                self.platform_touching = hit
+                if self.y_vel > 0:
+                    self.time_since_touched_floor = 0  # if floor is hit, touched_floor is now 0
+                self.y_vel = 0
+            break
+        
+        self.check_triggers(triggers)
+    
+    def update_position(self, platforms: SpatialGrid, triggers: TriggerLayer, dt):
+        if self.swept_collision:
+            return self.update_position_swept(platforms, triggers, dt)
+        return self.update_position_divided(platforms, triggers, dt)
+    
+    def update_position_divided(self, platforms: SpatialGrid, triggers: TriggerLayer, dt):
         # splits movement into "divide" parts
         # keep moving the player in steps
         # if they overlap something, move them back 1 step and stop moving
-        divide = 16
+        # the number of steps is picked so each one moves at most max_substep pixels (at least 2 so slopes still work)
+        distance = max(abs(self.x_vel), abs(self.y_vel)) * dt
+        divide = min(16, max(2, math.ceil(distance / self.max_substep)))
         change_x = True
         change_y = True
         for _ in range(divide):
-            self.check_in_portal(portals)
+            self.check_triggers(triggers)
             if change_x:
                 slope = False
                 self.x += (self.x_vel * dt) / divide
-                touching = self.touching(platforms, kill_areas, portals)
+                touching = self.touching(platforms, triggers)
                 if touching == "dead":
                     return "dead"
                 if touching != -1:
-                    for i in range(6):
+                    if abs(self.y_vel) <= 1 or self.x_vel >= self.terminal_x_vel:
                         # moving up slopes
-                        self.y -= i
-                        if not slope and (abs(self.y_vel) <= 1 or self.x_vel >= self.terminal_x_vel) and self.touching(platforms, kill_areas, portals) == -1:
-                            # self.x_vel *= (i / 100 + 0.9)   # slow down when moving up a slope - slightly dodgy
+                        step = self.first_clear(platforms, triggers, self.x, [self.y - i for i in range(1, 6)])
+                        if step is not None:
+                            # self.x_vel *= (step / 100 + 0.9)   # slow down when moving up a slope - slightly dodgy
+                            self.y -= step + 1
                             slope = True
-                        else:
-                            self.y += i
                             
                     if not slope:
                         self.x -= (self.x_vel * dt) / divide
-                        self.wall_jump_dir = 0 if self.x_vel == 0 else - int(self.x_vel / abs(self.x_vel))
-                        self.time_since_touched_wall = 0
-                        self.x_vel = 0
+                        self.hit_wall()
                         change_x = False
-                        if self.dashing:
-                            self.time_since_dash = self.dash_length       # if wall is hit, stop dashing
-                        self.y_vel = min(self.y_vel, self.wall_slide_vel)      # slide down walls
             if change_y:
                 self.y += (self.y_vel * dt) / divide
-                touching = self.touching(platforms, kill_areas, portals)
+                touching = self.touching(platforms, triggers)
                 if touching == "dead":
                     return "dead"
                 elif isinstance(touching, Platform):
@@ -254,31 +396,19 @@ class Player:
                     self.y_vel = 0
                     change_y = False
     
-    def tick(self, platforms: list[Platform], kill_areas: list[KillArea], portals: list[Portal], dt):
-        # controls all the collision and stuff
-        
-        # try to get the player out of an object, otherwise kill them
-        safe = True
-        for _ in range(6):
-            safe = self.touching(platforms, kill_areas, portals) == -1
-            if not safe:
-                self.y -= 1
-            else:
-                break
-        
-        if not safe:
-            self.y += 6
-            for _ in range(6):
-                safe = self.touching(platforms, kill_areas, portals) == -1
-                if not safe:
-                    self.y += 1
-                else:
-                    break
-        
-        if not safe:
+    def unstick(self, platforms: SpatialGrid, triggers: TriggerLayer):
+        # try to get the player out of an object (up to 5 pixels up, then down), otherwise kill them
+        if self.touching(platforms, triggers) == -1:
+            return
+        heights = [self.y - i for i in range(1, 6)] + [self.y + i for i in range(1, 6)]
+        free = self.first_clear(platforms, triggers, self.x, heights)
+        if free is None:
+            self.deaths += 1
             self.reset()
-        
-        
+        else:
+            self.y = heights[free]
+    
+    def update_velocity(self, dt):
         x_accel = self.x_accel * self.x_accel_air_mod if not self.can_jump else self.x_accel
         if self.time_since_dash < self.dash_length:
             max_speed = self.dash_strength
@@ -340,12 +470,15 @@ class Player:
             
         if self.dashing:
             self.y_vel = min(0, self.y_vel)
+    
+    def tick(self, platforms: SpatialGrid, triggers: TriggerLayer, dt):
+        # controls all the collision and stuff
+        self.unstick(platforms, triggers)
+        self.update_velocity(dt)
         
         self.platform_touching = None
-        dead = self.update_position(platforms, kill_areas, portals, dt)
+        dead = self.update_position(platforms, triggers, dt)
         if dead == "dead":
+            self.deaths += 1
             self.reset()
-        
-        if self.recording:
-            self.recorded_coords.append((self.x, self.y))
         
\ No newline at end of file
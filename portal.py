@@ -2,36 +2,73 @@ import pygame
 
 from consts import *
 
+from collision_shape import CachedRect
+from triggers import Trigger
 
-class Portal:
+
+class Portal(Trigger):
+    __slots__ = ("x_1", "y_1", "x_2", "y_2", "width", "height", "win", "vertical", "cached_rects", "cached_screen_rects")
+    
     def __init__(self, coords_1: tuple[float, float], coords_2: tuple[float, float], dims, win: pygame.surface.Surface):
         self.x_1, self.y_1 = coords_1
         self.x_2, self.y_2 = coords_2
         self.width, self.height = dims
         self.win = win
+        self.cached_rects = (CachedRect(), CachedRect())
+        self.cached_screen_rects = (CachedRect(), CachedRect())
         self.vertical = self.width <= self.height
 
     @property
     def rect_1(self) -> pygame.rect.Rect:
-        # actual rect used for collisions
-        return pygame.rect.Rect(self.x_1, self.y_1, self.width, self.height)
+        # actual rect used for collisions (the same rect every time, don't keep it)
+        return self.cached_rects[0].get(self.x_1, self.y_1, self.width, self.height)
 
     @property
     def rect_2(self) -> pygame.rect.Rect:
-        # actual rect used for collisions
-        return pygame.rect.Rect(self.x_2, self.y_2, self.width, self.height)
+        # actual rect used for collisions (the same rect every time, don't keep it)
+        return self.cached_rects[1].get(self.x_2, self.y_2, self.width, self.height)
+
+    @property
+    def volume_count(self) -> int:
+        return 2
+    
+    def volume_rect(self, index: int) -> pygame.rect.Rect:
+        return self.rect_2 if index else self.rect_1
 
     def screen_rect_1(self, screen_cords) -> pygame.rect.Rect:
         # rect with regard to the coordinates (top left) of the screen so is used to draw
-        return pygame.rect.Rect(self.x_1 - screen_cords[0], self.y_1 - screen_cords[1], self.width, self.height)
+        return self.cached_screen_rects[0].get(self.x_1 - screen_cords[0], self.y_1 - screen_cords[1], self.width, self.height)
 
     def screen_rect_2(self, screen_cords) -> pygame.rect.Rect:
         # rect with regard to the coordinates (top left) of the screen so is used to draw
-        return pygame.rect.Rect(self.x_2 - screen_cords[0], self.y_2 - screen_cords[1], self.width, self.height)
+        return self.cached_screen_rects[1].get(self.x_2 - screen_cords[0], self.y_2 - screen_cords[1], self.width, self.height)
 
     def draw(self, screen_coords):
         pygame.draw.rect(self.win, pygame.Color("blue"), self.screen_rect_1(screen_coords))
         pygame.draw.rect(self.win, pygame.Color("orange"), self.screen_rect_2(screen_coords))
         
-    def tick(self, player):
-        pass
+    def on_enter(self, player, index: int):
+        # teleports the player out of the other end, unless they have just come through a portal and haven't left it yet
+        if player.in_portal:
+            return
+        if index == 0:
+            from_x, from_y, to_x, to_y = self.x_1, self.y_1, self.x_2, self.y_2
+        else:
+            from_x, from_y, to_x, to_y = self.x_2, self.y_2, self.x_1, self.y_1
+        if self.vertical:
+            player.y = to_y + player.y - from_y
+            if player.x > from_x:
+                player.x = to_x - player.width
+            else:
+                player.x = to_x + self.width
+        else:
+            player.x = to_x + player.x - from_x
+            if player.y > from_y:
+                player.y = to_y - player.height
+            else:
+                player.y = to_y + self.height
+        player.in_portal = True
+    
+    # in_portal can be cleared while the player is still inside (eg restoring a replay's start state), so staying in acts the
+    # same as entering
+    on_stay = on_enter
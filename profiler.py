@@ -0,0 +1,254 @@
+import pygame
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from consts import *
+
+from platforms import Platform
+from player import Player
+from collision_shape import MaskShape
+
+
+PHASES = ("events", "platforms", "unstick", "velocity", "update_position", "scroll", "draw")
+PLAYER_PHASES = (("unstick", "unstick"), ("update_velocity", "velocity"), ("update_position", "update_position"))
+COUNTERS = ("probes", "mask_tests")
+PERCENTILES = (50, 95, 99)
+
+
+def patch_methods(root: type, names: tuple[str, ...], make_wrapper) -> list:
+    """replaces the methods called names on root and every subclass that defines its own with make_wrapper(method)
+    returns what unpatch_methods needs to put them back"""
+    patched = []
+    classes = [root]
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        for name in names:
+            if name in cls.__dict__:
+                method = cls.__dict__[name]
+                patched.append((cls, name, method))
+                setattr(cls, name, make_wrapper(method))
+    return patched
+
+
+def unpatch_methods(patched: list):
+    for cls, name, method in patched:
+        setattr(cls, name, method)
+
+
+def counted(counts: dict, key: str):
+    # wrapper that adds one to counts[key] every time the method is called
+    def make_wrapper(method):
+        def wrapper(*args, **kwargs):
+            counts[key] += 1
+            return method(*args, **kwargs)
+        return wrapper
+    return make_wrapper
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class AllocationCounter:
+    """counts the Rects and Masks made while it is running, to catch collision code that allocates every test
+
+    both the constructors (pygame.rect.Rect(...) and pygame.mask.Mask(...)) and methods that return new ones (move, union...)
+    are counted, it slows everything down a lot so it is only for debugging"""
+
+    METHODS = {"move", "union", "unionall", "clip", "clipline", "copy", "inflate", "clamp", "fit", "scale_by",
+               "overlap_mask", "scale", "connected_component", "connected_components", "get_bounding_rects", "convolve"}
+
+    def __init__(self):
+        self.count = 0
+        self.originals = None
+
+    def start(self):
+        rect_type, mask_type = pygame.rect.Rect, pygame.mask.Mask
+        self.originals = (rect_type, mask_type)
+        geometry_types = (rect_type, mask_type)
+
+        def make_rect(*args):
+            self.count += 1
+            return rect_type(*args)
+
+        def make_mask(*args, **kwargs):
+            self.count += 1
+            return mask_type(*args, **kwargs)
+
+        def profile(frame, event, arg):
+            if event == "c_call" and type(getattr(arg, "__self__", None)) in geometry_types and arg.__name__ in self.METHODS:
+                self.count += 1
+
+        # the game always makes them through the module so replacing the module attributes catches every one
+        pygame.rect.Rect = pygame.Rect = make_rect
+        pygame.mask.Mask = pygame.Mask = make_mask
+        sys.setprofile(profile)
+
+    def stop(self):
+        sys.setprofile(None)
+        if self.originals is not None:
+            pygame.rect.Rect = pygame.Rect = self.originals[0]
+            pygame.mask.Mask = pygame.Mask = self.originals[1]
+            self.originals = None
+
+
+class Frame:
+    def __init__(self, start: float):
+        self.start = start
+        self.duration = 0.0
+        self.events: list[tuple[str, float, float]] = []        # (phase, start, duration) in seconds
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+    def phase_time(self, phase: str) -> float:
+        return sum(duration for name, _, duration in self.events if name == phase)
+
+
+class FrameProfiler:
+    """times each phase of every frame and counts collision probes (calls to collide_rect and sweep) and mask tests
+
+    while it is off nothing is measured and there is no overhead, turning it on wraps the methods for each phase
+    the last history frames are kept for the overlay (percentiles of each phase) and for exporting"""
+
+    def __init__(self, game, history: int=FPS * 4):
+        self.game = game
+        self.enabled = False
+        self.frames: deque[Frame] = deque(maxlen=history)
+        self.frame: Frame | None = None
+        self.counts = dict.fromkeys(COUNTERS, 0)        # counts for the current frame, the wrappers keep adding to this dict
+        self.origin = time.perf_counter()
+        self.wrapped: list[str] = []                    # game methods timed with instance attributes
+        self.patched: list = []                          # class methods wrapped to count calls
+        self.overlay: pygame.surface.Surface | None = None
+        self.font: pygame.font.Font | None = None
+        self.last_overlay_time = -1000.0
+
+    def phase_methods(self):
+        # (name of a Game method, phase), these are wrapped on the game itself
+        return [("handle_events", "events"), ("tick_platforms", "platforms"), ("control_screen_scroll", "scroll"), ("draw", "draw")]
+
+    def timed(self, method, phase: str):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if self.frame is not None:
+                    self.frame.events.append((phase, start, time.perf_counter() - start))
+        return wrapper
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        game = self.game
+        for name, phase in self.phase_methods():
+            setattr(game, name, self.timed(getattr(game, name), phase))
+            self.wrapped.append(name)
+        # the player has slots so its methods are wrapped on the class instead
+        self.patched = [entry for name, phase in PLAYER_PHASES for entry in patch_methods(Player, (name,), lambda method, phase=phase: self.timed(method, phase))]
+        counts = self.counts
+        self.patched += (patch_methods(Platform, ("collide_rect", "sweep", "clear_tops"), counted(counts, "probes"))
+                        + patch_methods(Platform, ("solid_in",), counted(counts, "mask_tests"))
+                        + patch_methods(MaskShape, ("collide_rect",), counted(counts, "mask_tests")))
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for name in self.wrapped:
+            delattr(self.game, name)      # the class's method is used again
+        self.wrapped = []
+        unpatch_methods(self.patched)
+        self.patched = []
+        self.frame = None
+        self.overlay = None
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.frame = Frame(time.perf_counter())
+        for key in COUNTERS:
+            self.counts[key] = 0
+
+    def end_frame(self):
+        frame = self.frame
+        if not self.enabled or frame is None:
+            return
+        frame.duration = time.perf_counter() - frame.start
+        frame.counts = dict(self.counts)
+        self.frames.append(frame)
+        self.frame = None
+        self.draw_overlay()
+
+    def summary(self) -> dict[str, tuple[float, ...]]:
+        # percentiles (in milliseconds, or counts per frame) of every phase over the kept frames
+        frames = list(self.frames)
+        rows = {"frame": tuple(percentile([frame.duration * 1000 for frame in frames], p) for p in PERCENTILES)}
+        for phase in PHASES:
+            times = [frame.phase_time(phase) * 1000 for frame in frames]
+            rows[phase] = tuple(percentile(times, p) for p in PERCENTILES)
+        for key in COUNTERS:
+            counts = [frame.counts[key] for frame in frames]
+            rows[key] = tuple(percentile(counts, p) for p in PERCENTILES)
+        return rows
+
+    def draw_overlay(self):
+        # the text is only remade a few times a second, it is slow to render
+        now = time.perf_counter()
+        if self.overlay is None or now - self.last_overlay_time > 0.25:
+            self.last_overlay_time = now
+            if self.font is None:
+                pygame.font.init()
+                self.font = pygame.font.Font(None, 18)
+            rows = [[f"budget {1000 / FPS:.2f}ms"] + [f"p{p}" for p in PERCENTILES]]
+            for name, values in self.summary().items():
+                rows.append([name] + [f"{value:.0f}" if name in COUNTERS else f"{value:.2f}" for value in values])
+            
+            line_height = self.font.get_linesize()
+            self.overlay = pygame.Surface((130 + 60 * len(PERCENTILES), line_height * len(rows) + 10))
+            for i, row in enumerate(rows):
+                for j, cell in enumerate(row):
+                    text = self.font.render(cell, True, pygame.Color("white"))
+                    self.overlay.blit(text, (5 if j == 0 else 130 + 60 * (j - 1), 5 + i * line_height))
+        rect = self.game.win.blit(self.overlay, (5, 5))
+        pygame.display.update(rect)
+
+    def export(self, folder: str="profiles") -> tuple[str, str]:
+        """writes the kept frames as a chrome trace (open in chrome://tracing or perfetto) and a csv with a row per frame
+        returns both paths"""
+        os.makedirs(folder, exist_ok=True)
+        name = os.path.join(folder, time.strftime("%Y%m%d-%H%M%S"))
+        frames = list(self.frames)
+
+        events = []
+        for frame in frames:
+            events.append({"name": "frame", "ph": "X", "pid": 0, "tid": 0,
+                           "ts": (frame.start - self.origin) * 1e6, "dur": frame.duration * 1e6})
+            for phase, start, duration in frame.events:
+                events.append({"name": phase, "ph": "X", "pid": 0, "tid": 0, "ts": (start - self.origin) * 1e6, "dur": duration * 1e6})
+            events.append({"name": "collisions", "ph": "C", "pid": 0, "tid": 0, "ts": (frame.start - self.origin) * 1e6, "args": frame.counts})
+        with open(name + ".json", "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+        with open(name + ".csv", "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["start_ms", "frame_ms"] + [f"{phase}_ms" for phase in PHASES] + list(COUNTERS))
+            for frame in frames:
+                writer.writerow([round((frame.start - self.origin) * 1000, 3), round(frame.duration * 1000, 3)]
+                                + [round(frame.phase_time(phase) * 1000, 3) for phase in PHASES]
+                                + [frame.counts[key] for key in COUNTERS])
+        return name + ".json", name + ".csv"
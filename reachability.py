@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pygame
+
+from consts import *
+
+from inputs import NAMES, JUMP, JUMP_PRESS, JUMP_RELEASE, DASH
+from replay import PLAYER_FIELDS
+
+
+# the search holds each of these for MACRO_TICKS ticks at a time, dash only counts as pressed on the first tick
+ACTIONS = ("idle", "left", "right", "jump", "left+jump", "right+jump", "left+dash", "right+dash")
+MACRO_TICKS = PHYSICS_HZ // 8
+POSITION_CELL = 32      # states closer than this (in pixels) with similar velocities and timers count as the same
+VELOCITY_CELL = 400     # pixels per second
+REGION_SIZE = 64        # the reachability map is made of squares this big
+FALL_MARGIN = 400       # states this far below the bottom of the level are dropped, they are just falling forever
+
+
+def action_bits(action: str) -> int:
+    bits = 0
+    for name in action.split("+"):
+        if name != "idle":
+            bits |= NAMES[name]
+    return bits
+
+
+ACTION_BITS = tuple(action_bits(action) for action in ACTIONS)
+X, Y = PLAYER_FIELDS.index("x"), PLAYER_FIELDS.index("y")
+
+
+def player_state(player) -> tuple:
+    return tuple(getattr(player, name) for name in PLAYER_FIELDS)
+
+
+def set_player_state(player, state: tuple):
+    for name, value in zip(PLAYER_FIELDS, state):
+        setattr(player, name, value)
+    player.platform_touching = None
+    player.triggers_inside = {}
+
+
+def state_key(player) -> tuple:
+    """the discretised state used to tell whether somewhere has been explored already
+    only the things that change what the player can do next are kept (and only roughly)"""
+    return (int(player.x) // POSITION_CELL, int(player.y) // POSITION_CELL,
+            round(player.x_vel / VELOCITY_CELL), round(player.y_vel / VELOCITY_CELL),
+            player.can_jump, player.wall_jump_dir if player.can_wall_jump else 0,
+            player.time_since_dash > player.dash_cooldown, player.jumping, player.in_portal)
+
+
+def region_of(x: float, y: float) -> tuple[int, int]:
+    return int(x) // REGION_SIZE, int(y) // REGION_SIZE
+
+
+# each worker process loads the level once and keeps it here
+worker_game = None
+worker_floor = 0
+
+
+def init_worker(level_path: str):
+    global worker_game, worker_floor
+    from game import Game       # imported here so the main process doesn't need a display just to parse arguments
+    worker_game = Game(level_path, headless=True)
+    worker_floor = level_bounds(worker_game).bottom + FALL_MARGIN
+
+
+def level_bounds(game) -> pygame.rect.Rect:
+    bounds = game.player.rect.copy()
+    for platform in game.platforms:
+        bounds.union_ip(platform.bounds)
+    return bounds
+
+
+def run_action(game, state: tuple, action: int) -> tuple | None:
+    """plays one action from state with the game's own physics, returns the state after it or None if the player died"""
+    player = game.player
+    set_player_state(player, state)
+    deaths = player.deaths
+    held = ACTION_BITS[action]
+    for tick in range(MACRO_TICKS):
+        bits = held if tick == 0 else held & ~DASH
+        # work out the jump button's edges from whether it was held last tick, like ScriptedInput does
+        if bits & JUMP and not player.jumping:
+            bits |= JUMP_PRESS
+        elif player.jumping and not bits & JUMP:
+            bits |= JUMP_RELEASE
+        game.apply_input(bits)
+        player.tick(game.broadphase, game.triggers, PHYSICS_DT)
+        if player.deaths != deaths:
+            return None
+    return player_state(player)
+
+
+def expand(states: list[tuple]) -> list[list[tuple[tuple, tuple] | None]]:
+    """runs on a worker, plays every action from every state (moving platforms stay where they started)
+    returns the key and state after each one, or None if the player died or fell out of the level"""
+    results = []
+    player = worker_game.player
+    for state in states:
+        after = []
+        for action in range(len(ACTIONS)):
+            new_state = run_action(worker_game, state, action)
+            if new_state is None or player.y > worker_floor:
+                after.append(None)
+            else:
+                after.append((state_key(player), new_state))
+        results.append(after)
+    return results
+
+
+class Reachability:
+    """breadth first search over the states the player can get into from a spawn point
+
+    each layer of the search is split into chunks that are expanded on a pool of processes (each with its own copy of the
+    level), the main process keeps every discretised state it has seen so nothing is explored twice
+    because it is breadth first the first time a region is reached is with the fewest actions"""
+
+    def __init__(self, level_path: str, spawn: tuple[float, float]=(100, 100), workers: int | None=None):
+        from game import Game
+        self.level_path = level_path
+        self.spawn = spawn
+        self.workers = workers or os.cpu_count() or 1
+        self.game = Game(level_path, headless=True)      # only used for the start state and drawing the map
+        self.game.player.reset(spawn)
+        start = player_state(self.game.player)
+        start_key = state_key(self.game.player)
+        self.parents: dict[tuple, tuple[tuple | None, int]] = {start_key: (None, -1)}    # key -> (key it came from, action)
+        self.regions: dict[tuple[int, int], tuple] = {region_of(*spawn): start_key}      # region -> first key to reach it
+        self.frontier: list[tuple[tuple, tuple]] = [(start_key, start)]
+        self.depth = 0
+
+    def run(self, max_depth: int=200, max_states: int=200000, progress=None):
+        with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.level_path,)) as pool:
+            while self.frontier and self.depth < max_depth and len(self.parents) < max_states:
+                chunk_size = max(1, len(self.frontier) // (self.workers * 4))
+                chunks = [self.frontier[i:i + chunk_size] for i in range(0, len(self.frontier), chunk_size)]
+                frontier = []
+                for chunk, results in zip(chunks, pool.map(expand, [[state for _, state in chunk] for chunk in chunks])):
+                    for (key, _), after in zip(chunk, results):
+                        for action, result in enumerate(after):
+                            if result is None:
+                                continue
+                            new_key, new_state = result
+                            if new_key in self.parents:
+                                continue
+                            self.parents[new_key] = (key, action)
+                            frontier.append((new_key, new_state))
+                            self.regions.setdefault(region_of(new_state[X], new_state[Y]), new_key)
+                self.frontier = frontier
+                self.depth += 1
+                if progress is not None:
+                    progress(self)
+
+    def actions_to(self, key: tuple) -> list[str]:
+        actions = []
+        while True:
+            key, action = self.parents[key]
+            if key is None:
+                break
+            actions.append(ACTIONS[action])
+        return actions[::-1]
+
+    def script_to(self, key: tuple) -> str:
+        # the actions to reach key as a ScriptedInput script, repeated actions are merged unless they dash
+        tokens = []
+        for action in self.actions_to(key):
+            if tokens and tokens[-1][0] == action and "dash" not in action:
+                tokens[-1][1] += MACRO_TICKS
+            else:
+                tokens.append([action, MACRO_TICKS])
+        return " ".join(f"{action}*{ticks}" for action, ticks in tokens)
+
+    def report(self) -> dict:
+        return {
+            "level": self.level_path,
+            "spawn": list(self.spawn),
+            "region_size": REGION_SIZE,
+            "states": len(self.parents),
+            "depth": self.depth,
+            "finished": not self.frontier,
+            "regions": {f"{x},{y}": self.script_to(key) for (x, y), key in sorted(self.regions.items())},
+        }
+
+    def draw_map(self, file_path: str, scale: int=4):
+        # the level in grey with every reachable region in green and the spawn in red
+        bounds = level_bounds(self.game)
+        for x, y in self.regions:
+            bounds.union_ip((x * REGION_SIZE, y * REGION_SIZE, REGION_SIZE, REGION_SIZE))
+        surface = pygame.Surface(bounds.size)
+        surface.fill(pygame.Color("white"))
+        overlay = pygame.Surface(bounds.size, pygame.SRCALPHA)
+        for x, y in self.regions:
+            pygame.draw.rect(overlay, (0, 200, 0, 120), (x * REGION_SIZE - bounds.x, y * REGION_SIZE - bounds.y, REGION_SIZE, REGION_SIZE))
+        for platform in self.game.platforms:
+            platform.draw(bounds.topleft, surface)
+        surface.blit(overlay, (0, 0))
+        pygame.draw.circle(surface, pygame.Color("red"), (self.spawn[0] - bounds.x, self.spawn[1] - bounds.y), 12)
+        pygame.image.save(pygame.transform.smoothscale(surface, (max(1, bounds.width // scale), max(1, bounds.height // scale))), file_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="find everywhere the player can get to in a level and the inputs to get there")
+    parser.add_argument("level", help="folder containing the level, eg levels/4")
+    parser.add_argument("--spawn", type=float, nargs=2, default=(100, 100), help="where the player starts")
+    parser.add_argument("--workers", type=int, help="processes to use (defaults to one per core)")
+    parser.add_argument("--max-depth", type=int, default=200, help=f"most actions ({MACRO_TICKS} ticks each) in a row")
+    parser.add_argument("--max-states", type=int, default=200000, help="stop after exploring this many states")
+    parser.add_argument("--output", default="reachability", help="writes OUTPUT.json (inputs to reach each region) and OUTPUT.png (map)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    def progress(search: Reachability):
+        print(f"depth {search.depth}: {len(search.parents)} states, {len(search.regions)} regions, "
+              f"{len(search.frontier)} to explore ({time.perf_counter() - start:.1f}s)")
+
+    search = Reachability(args.level, tuple(args.spawn), args.workers)
+    search.run(args.max_depth, args.max_states, progress)
+    with open(args.output + ".json", "w") as file:
+        json.dump(search.report(), file, indent=2)
+    search.draw_map(args.output + ".png")
+    print(f"{len(search.regions)} regions reachable, written to {args.output}.json and {args.output}.png")
+
+
+if __name__ == "__main__":
+    main()
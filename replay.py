@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+
+from consts import *
+
+from inputs import ScriptedInput
+
+
+# replay files are a header (with the level and the state of everything when recording started) followed by a zlib
+# stream of records:
+#   input runs - the same input bits for count ticks in a row, inputs rarely change every tick so these are tiny
+#   checkpoints - where the player was after a tick, used to notice if playback stops matching the recording
+# a few minutes of play is a few kilobytes
+MAGIC = b"PRPL"
+VERSION = 4     # 3: reset puts the whole level back, not just the player, 4: moving triggers are in the start state
+HEADER = struct.Struct("<4sIdII")       # magic, version, seconds per tick, length of level path, length of start state
+RUN = struct.Struct("<BBH")             # tag, input bits, number of ticks
+CHECKPOINT = struct.Struct("<BIdddd")   # tag, ticks since the start, x, y, x vel, y vel
+RUN_TAG = 1
+CHECKPOINT_TAG = 2
+MAX_RUN = 0xffff
+
+# everything about the player that affects later ticks
+PLAYER_FIELDS = ("x", "y", "x_vel", "y_vel", "time_since_dash", "time_since_jump", "time_since_touched_floor",
+                 "time_since_touched_wall", "wall_jump_dir", "wall_jumping", "right", "left", "jumping", "in_portal", "deaths")
+BOOL_FIELDS = ("wall_jumping", "right", "left", "jumping", "in_portal")
+INT_FIELDS = ("wall_jump_dir", "deaths")
+PLAYER_STATE = struct.Struct(f"<{len(PLAYER_FIELDS)}didd")   # player fields, index of the platform touched (-1 for none), screen x, screen y
+PLATFORM_STATE = struct.Struct("<Iddd")                         # index in game.platforms, x, y, time along its vel path
+TRIGGER_STATE = struct.Struct("<Idd")                           # index in game.triggers.triggers, x, y
+INSIDE_STATE = struct.Struct("<II")                             # index in game.triggers.triggers, index of the volume
+COUNT = struct.Struct("<I")
+
+
+def save_state(game) -> bytes:
+    # the state of the player, moving platforms and moving triggers, so a recording can start from anywhere
+    player = game.player
+    touching = game.platforms.index(player.platform_touching) if player.platform_touching in game.platforms else -1
+    data = [PLAYER_STATE.pack(*[float(getattr(player, name)) for name in PLAYER_FIELDS], touching, *game.screen_coords)]
+    moving = [(i, platform) for i, platform in enumerate(game.platforms) if platform.vel_path]
+    data.append(struct.pack("<Id", len(moving), game.platform_time))
+    for i, platform in moving:
+        data.append(PLATFORM_STATE.pack(i, platform.x, platform.y, platform.path_time))
+
+    triggers = game.triggers
+    trigger_index = {id(trigger): i for i, trigger in enumerate(triggers.triggers)}
+    data.append(COUNT.pack(len(triggers.moving)))
+    for trigger in triggers.moving:
+        data.append(TRIGGER_STATE.pack(trigger_index[id(trigger)], trigger.x, trigger.y))
+    # the volumes the player is in, so entering and leaving them plays back the same
+    inside = [volume for volume in player.triggers_inside.values() if id(volume.trigger) in trigger_index]
+    data.append(COUNT.pack(len(inside)))
+    for volume in inside:
+        data.append(INSIDE_STATE.pack(trigger_index[id(volume.trigger)], volume.index))
+    return b"".join(data)
+
+
+def load_state(game, data: bytes):
+    player = game.player
+    *values, touching, screen_x, screen_y = PLAYER_STATE.unpack_from(data)
+    for name, value in zip(PLAYER_FIELDS, values):
+        if name in BOOL_FIELDS:
+            value = bool(value)
+        elif name in INT_FIELDS:
+            value = int(value)
+        setattr(player, name, value)
+    player.platform_touching = game.platforms[touching] if touching >= 0 else None
+    game.screen_coords = [screen_x, screen_y]
+
+    offset = PLAYER_STATE.size
+    count, game.platform_time = struct.unpack_from("<Id", data, offset)
+    offset += 12
+    for _ in range(count):
+        i, x, y, path_time = PLATFORM_STATE.unpack_from(data, offset)
+        offset += PLATFORM_STATE.size
+        platform = game.platforms[i]
+        platform.x, platform.y = x, y
+        platform.path_time = path_time
+        game.broadphase.update(platform)
+
+    triggers = game.triggers
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    for _ in range(count):
+        i, x, y = TRIGGER_STATE.unpack_from(data, offset)
+        offset += TRIGGER_STATE.size
+        trigger = triggers.triggers[i]
+        trigger.x, trigger.y = x, y
+        triggers.reindex(trigger)
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    player.triggers_inside = {}
+    for _ in range(count):
+        i, index = INSIDE_STATE.unpack_from(data, offset)
+        offset += INSIDE_STATE.size
+        volume = triggers.volumes[id(triggers.triggers[i])][index]
+        player.triggers_inside[id(volume)] = volume
+
+
+class ReplayRecorder:
+    """records the inputs of every tick (and a checkpoint of the player every checkpoint_interval ticks) to a replay file
+
+    inputs go into a fixed size buffer which is run length encoded and streamed to the file when it fills up,
+    so memory use doesn't grow however long the recording is"""
+
+    def __init__(self, game, file_path: str, dt: float=PHYSICS_DT, checkpoint_interval: int=PHYSICS_HZ, buffer_ticks: int=4096):
+        self.file_path = file_path
+        self.checkpoint_interval = checkpoint_interval
+        self.buffer = bytearray(buffer_ticks)
+        self.buffered = 0
+        self.ticks = 0
+        self.run_bits = 0       # the run that is still going, it is only written once the input changes
+        self.run_length = 0
+
+        folder = os.path.dirname(file_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        level_path = game.level_path.encode()
+        state = save_state(game)
+        self.file = open(file_path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, dt, len(level_path), len(state)) + level_path + state)
+        self.compressor = zlib.compressobj(9)
+
+    def record(self, bits: int, player):
+        # called after every tick with the inputs it used and the player after it
+        self.buffer[self.buffered] = bits
+        self.buffered += 1
+        self.ticks += 1
+        if self.buffered == len(self.buffer):
+            self.flush_inputs()
+        if self.ticks % self.checkpoint_interval == 0:
+            self.file.write(self.compressor.compress(CHECKPOINT.pack(CHECKPOINT_TAG, self.ticks, player.x, player.y, player.x_vel, player.y_vel)))
+
+    def flush_inputs(self):
+        runs = []
+        bits, length = self.run_bits, self.run_length
+        for tick in self.buffer[:self.buffered]:
+            if tick == bits and length < MAX_RUN:
+                length += 1
+                continue
+            if length:
+                runs.append(RUN.pack(RUN_TAG, bits, length))
+            bits, length = tick, 1
+        self.run_bits, self.run_length = bits, length
+        self.buffered = 0
+        self.file.write(self.compressor.compress(b"".join(runs)))
+
+    def close(self) -> int:
+        # finishes the file and returns its size in bytes
+        self.flush_inputs()
+        if self.run_length:
+            self.file.write(self.compressor.compress(RUN.pack(RUN_TAG, self.run_bits, self.run_length)))
+        self.file.write(self.compressor.flush())
+        size = self.file.tell()
+        self.file.close()
+        return size
+
+
+class Replay(ScriptedInput):
+    """a recorded run, plays back like any other scripted input once its start state has been restored"""
+
+    def __init__(self, ticks: bytes, dt: float, level_path: str, start_state: bytes, checkpoints: dict[int, tuple[float, float, float, float]]):
+        super().__init__(ticks)         # type: ignore
+        self.dt = dt
+        self.level_path = level_path
+        self.start_state = start_state
+        self.checkpoints = checkpoints      # ticks since the start -> (x, y, x vel, y vel) of the player after that tick
+
+    @classmethod
+    def load(cls, file_path: str) -> "Replay":
+        with open(file_path, "rb") as file:
+            data = file.read()
+        magic, version, dt, path_length, state_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{file_path} isn't a replay file this version can read")
+        offset = HEADER.size
+        level_path = data[offset:offset + path_length].decode()
+        offset += path_length
+        start_state = data[offset:offset + state_length]
+        body = zlib.decompress(data[offset + state_length:])
+
+        ticks = bytearray()
+        checkpoints = {}
+        offset = 0
+        while offset < len(body):
+            if body[offset] == RUN_TAG:
+                _, bits, length = RUN.unpack_from(body, offset)
+                ticks.extend(bytes((bits,)) * length)
+                offset += RUN.size
+            elif body[offset] == CHECKPOINT_TAG:
+                _, tick, *player = CHECKPOINT.unpack_from(body, offset)
+                checkpoints[tick] = tuple(player)
+                offset += CHECKPOINT.size
+            else:
+                raise ValueError(f"{file_path} is corrupt")
+        return cls(bytes(ticks), dt, level_path, start_state, checkpoints)
+
+    def restore(self, game):
+        # puts the game back how it was when recording started and plays from the beginning
+        load_state(game, self.start_state)
+        self.rewind()
+
+    def matches(self, player) -> bool:
+        # whether the player is where it was in the recording, if there is a checkpoint for this tick
+        expected = self.checkpoints.get(self.pointer)
+        return expected is None or expected == (player.x, player.y, player.x_vel, player.y_vel)
+
+
+def play(game, replay: Replay) -> dict:
+    """plays a replay as fast as possible without drawing, returns where the player ended up and the first tick
+    that didn't match the recording (None if it all matched)"""
+    replay.restore(game)
+    desync = None
+    start = time.perf_counter()
+    while not replay.finished:
+        game.step(replay.next(), replay.dt)
+        if desync is None and not replay.matches(game.player):
+            desync = replay.pointer
+    elapsed = time.perf_counter() - start
+    return {
+        "x": game.player.x,
+        "y": game.player.y,
+        "deaths": game.player.deaths,
+        "ticks": len(replay),
+        "desync": desync,
+        "seconds": elapsed,
+        "ticks_per_second": len(replay) / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    from game import Game
+
+    parser = argparse.ArgumentParser(description="play back a replay recorded with F1")
+    parser.add_argument("replay", help="replay file, eg replays/20240101-120000.rpl")
+    parser.add_argument("--window", action="store_true", help="watch it in real time instead of running it as fast as possible")
+    args = parser.parse_args()
+
+    replay = Replay.load(args.replay)
+    game = Game(replay.level_path, headless=not args.window)
+    if args.window:
+        game.start_playback(replay)
+        game.run()
+    else:
+        print(json.dumps(play(game, replay)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import operator
+
+from replay import PLAYER_FIELDS
+
+
+PLAYER_STATE = operator.attrgetter(*PLAYER_FIELDS)
+POSITION = operator.attrgetter("x", "y")
+PATH_TIME = operator.attrgetter("path_time")
+
+
+class Snapshot:
+    """everything later ticks of a game depend on, for rewinding to a checkpoint, re-simulating from an earlier tick or
+    trying several things from the same point (restoring doesn't use the snapshot up)
+
+    only what can change while playing is kept: the player, how far along their paths the moving platforms are (where
+    they are follows from that), where the moving triggers are, the platform clock and the screen (which decides which
+    platforms are awake)
+    it holds on to the objects it was taken from so it only makes sense for the game it came from, platforms and
+    triggers added to the level since are left as they are when it is restored unless track_platforms is called"""
+
+    __slots__ = ("player", "platform_touching", "triggers_inside", "platform_time", "screen_coords", "platforms", "path_times",
+                 "triggers", "trigger_positions")
+
+    def __init__(self, game):
+        player = game.player
+        self.player = PLAYER_STATE(player)
+        self.platform_touching = player.platform_touching
+        self.triggers_inside = dict(player.triggers_inside)
+        self.platform_time = game.platform_time
+        self.screen_coords = tuple(game.screen_coords)
+        self.platforms = tuple(game.moving_platforms)
+        self.path_times = tuple(map(PATH_TIME, self.platforms))
+        self.triggers = tuple(game.triggers.moving)
+        self.trigger_positions = tuple(map(POSITION, self.triggers))
+
+    def restore(self, game):
+        player = game.player
+        for name, value in zip(PLAYER_FIELDS, self.player):
+            setattr(player, name, value)
+        touching = self.platform_touching
+        player.platform_touching = touching if touching is None or touching in game.broadphase else None
+        player.triggers_inside = dict(self.triggers_inside)
+        game.platform_time = self.platform_time
+        game.screen_coords = list(self.screen_coords)
+        broadphase = game.broadphase
+        for platform, path_time in zip(self.platforms, self.path_times):
+            # ones that have been removed since are skipped, carrying the player isn't wanted
+            if platform.path_time != path_time and platform in broadphase:
+                platform.move_to(path_time, broadphase=broadphase)
+
+        triggers = game.triggers
+        for trigger, (x, y) in zip(self.triggers, self.trigger_positions):
+            if (trigger.x != x or trigger.y != y) and trigger in triggers.moving:
+                trigger.x, trigger.y = x, y
+                triggers.reindex(trigger)
+
+
+    def track_platforms(self, game):
+        """brings the snapshot up to date after the level's moving platforms have changed (eg images were reloaded), ones
+        that have gone are dropped and new ones start at the snapshot's time, like they do when they are added"""
+        path_times = dict(zip(map(id, self.platforms), self.path_times))
+        self.platforms = tuple(game.moving_platforms)
+        self.path_times = tuple(path_times.get(id(platform), self.platform_time) for platform in self.platforms)
+        if self.platform_touching is not None and self.platform_touching not in game.broadphase:
+            self.platform_touching = None
@@ -0,0 +1,106 @@
+import pygame
+import numpy
+import math
+
+from broadphase import SpatialGrid
+from platforms import ImageStage
+from tile_cache import TileCache
+
+
+BACKGROUND = pygame.Color("white")
+BEHIND = pygame.Color("black")      # what chunks are drawn onto a second time to find which pixels the art covers
+KEY = pygame.Color(255, 0, 255)     # the colour empty pixels are set to, unless the art already uses it
+
+
+class StaticLayer:
+    """everything that never moves, drawn once into square chunks so a frame is a few blits however many platforms there are
+
+    chunks are drawn when they are first needed and kept in a TileCache, so only the chunks near where the player has
+    been stay in memory
+    adding or removing a platform only redraws the chunks it overlaps (the next time they are on screen)"""
+
+    def __init__(self, chunk_size: int, cache: TileCache):
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.grid = SpatialGrid(chunk_size)      # the static platforms, cells are the same as chunks
+        self.bakes = 0
+
+    def __len__(self):
+        return len(self.grid)
+
+    def __contains__(self, platform):
+        return platform in self.grid
+
+    def chunks_in(self, rect: pygame.rect.Rect) -> list[tuple[int, int]]:
+        return self.grid.cells_for(rect)
+
+    def invalidate(self, rect: pygame.rect.Rect):
+        # forgets the chunks rect overlaps so they are redrawn
+        for chunk_x, chunk_y in self.chunks_in(rect):
+            self.cache.remove((id(self), chunk_x, chunk_y))
+
+    def add(self, platform):
+        self.grid.insert(platform)
+        self.invalidate(platform.bounds)
+
+    def remove(self, platform):
+        self.grid.remove(platform)
+        self.invalidate(platform.bounds)
+
+    def clear(self):
+        self.grid.clear()
+        self.cache.discard(self)
+
+    def bake(self, chunk_x: int, chunk_y: int) -> tuple[pygame.surface.Surface | None, int]:
+        # draws one chunk, returns it and how many bytes it takes up (empty chunks are None and take up nothing)
+        size = self.chunk_size
+        chunk = pygame.rect.Rect(chunk_x * size, chunk_y * size, size, size)
+        platforms = [platform for platform in self.grid.query(chunk) if chunk.colliderect(platform.bounds)]
+        if not platforms:
+            return None, 0
+        self.bakes += 1
+        # run length encoded colour key blits are far faster than per pixel alpha, so the chunk is drawn onto the
+        # background and again onto black, pixels that came out as the background and black are empty and are set to a
+        # colour the art doesn't use which is made transparent (white in the art stays white, semi transparent edges
+        # keep how they look over the background)
+        surface = self.render(platforms, chunk, BACKGROUND)
+        if not any(isinstance(platform, ImageStage) for platform in platforms):
+            # only images can have white in them, everything else is drawn black
+            surface.set_colorkey(BACKGROUND, pygame.RLEACCEL)
+            return surface, size * size * surface.get_bytesize()
+        behind = self.render(platforms, chunk, BEHIND)
+        pixels = pygame.surfarray.pixels2d(surface)
+        empty = (pixels == surface.map_rgb(BACKGROUND)) & (pygame.surfarray.pixels2d(behind) == behind.map_rgb(BEHIND))
+        key = KEY if not (pixels == surface.map_rgb(KEY)).any() else unused_colour(pygame.surfarray.array3d(surface)[~empty])
+        pixels[empty] = surface.map_rgb(key)
+        del pixels      # unlocks the surface
+        surface.set_colorkey(key, pygame.RLEACCEL)
+        return surface, size * size * surface.get_bytesize()
+
+    def render(self, platforms: list, chunk: pygame.rect.Rect, background: pygame.Color) -> pygame.surface.Surface:
+        surface = pygame.Surface(chunk.size).convert()
+        surface.fill(background)
+        for platform in platforms:
+            platform.draw(chunk.topleft, surface)
+        return surface
+
+    def draw(self, win: pygame.surface.Surface, screen_coords, view: pygame.rect.Rect):
+        """blits the parts of the chunks that overlap view (in level coordinates)"""
+        size = self.chunk_size
+        # rounded the same way level images are when they are drawn straight onto the window so they land on the same pixels
+        screen_x, screen_y = math.ceil(screen_coords[0] - 0.5), math.ceil(screen_coords[1] - 0.5)
+        for chunk_x, chunk_y in self.chunks_in(view):
+            surface = self.cache.get((id(self), chunk_x, chunk_y), lambda: self.bake(chunk_x, chunk_y))
+            if surface is None:
+                continue
+            left, top = chunk_x * size, chunk_y * size
+            area = view.move(-left, -top).clip(surface.get_rect())
+            win.blit(surface, (left + area.x - screen_x, top + area.y - screen_y), area)
+
+
+def unused_colour(pixels: numpy.ndarray) -> pygame.Color:
+    # the lowest colour (as 0xRRGGBB) that none of pixels (rgb rows) are, there are always fewer pixels than colours
+    used = numpy.unique(pixels[:, 0].astype(numpy.int32) << 16 | pixels[:, 1].astype(numpy.int32) << 8 | pixels[:, 2])
+    gaps = numpy.flatnonzero(used != numpy.arange(len(used)))
+    colour = int(gaps[0]) if len(gaps) else len(used)
+    return pygame.Color(colour >> 16, colour >> 8 & 0xFF, colour & 0xFF)
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+
+class TileCache:
+    """keeps the most recently used tiles of streamed images in memory, evicting the least recently used ones
+    once their total size goes over budget (in bytes)"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.tiles: OrderedDict = OrderedDict()     # key -> (tile, size), oldest first
+        self.size = 0
+        self.peak_size = 0      # the most size has been, tiles can go over budget until the next one is loaded
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def get(self, key, loader):
+        """returns the tile for key, calling loader() to make it (which returns the tile and its size) if it isn't resident"""
+        entry = self.tiles.get(key)
+        if entry is not None:
+            self.tiles.move_to_end(key)
+            return entry[0]
+
+        tile, size = loader()
+        self.tiles[key] = (tile, size)
+        self.size += size
+        self.peak_size = max(self.peak_size, self.size)
+        self.loads += 1
+        # always keep the tile that was just asked for, even if it alone is over budget
+        while self.size > self.budget and len(self.tiles) > 1:
+            _, (_, evicted_size) = self.tiles.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+        return tile
+
+    def remove(self, key):
+        entry = self.tiles.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def discard(self, owner):
+        # removes every tile belonging to owner (keys are (owner id, tile x, tile y))
+        for key in [key for key in self.tiles if key[0] == id(owner)]:
+            _, size = self.tiles.pop(key)
+            self.size -= size
+
+    def clear(self):
+        self.tiles.clear()
+        self.size = 0
@@ -0,0 +1,136 @@
+import pygame
+
+from broadphase import SpatialGrid
+
+
+class Trigger:
+    """something the player sets off by overlapping it (kill areas, portals, later checkpoints and goals)
+
+    a trigger is made of one or more volumes (rects), each one is indexed separately so triggers with far apart parts
+    (like the two ends of a portal) don't cover everything between them
+    the on_ methods are called by TriggerLayer.update with the index of the volume that was entered, stayed in or left"""
+
+    __slots__ = ()
+
+    lethal = False      # whether overlapping it kills the player (checked on every collision probe, not just by events)
+    moving = False      # moving triggers are ticked every physics tick and re-indexed
+
+    @property
+    def volume_count(self) -> int:
+        return 1
+
+    def volume_rect(self, index: int) -> pygame.rect.Rect:
+        return self.rect        # type: ignore
+
+    def tick(self, dt: float):
+        pass
+
+    def on_enter(self, player, index: int):
+        pass
+
+    def on_stay(self, player, index: int):
+        pass
+
+    def on_exit(self, player, index: int):
+        pass
+
+
+class Volume:
+    # one rect of a trigger, this is what the grid indexes
+    __slots__ = ("trigger", "index")
+
+    def __init__(self, trigger: Trigger, index: int):
+        self.trigger = trigger
+        self.index = index
+
+    @property
+    def bounds(self) -> pygame.rect.Rect:
+        return self.trigger.volume_rect(self.index)
+
+
+class TriggerLayer:
+    """spatial index of every trigger volume, so finding the triggers a rect overlaps doesn't depend on how many there are
+
+    update works out which volumes the player has entered, stayed in and left since the last update from a single
+    query and calls the triggers' on_enter, on_stay and on_exit
+    the volumes the player is in are kept on the player (player.triggers_inside) so a layer can be shared"""
+
+    def __init__(self, cell_size: int=256):
+        self.grid = SpatialGrid(cell_size)
+        self.triggers: list[Trigger] = []
+        self.volumes: dict[int, list[Volume]] = {}      # id(trigger) -> its volumes
+        self.moving: list[Trigger] = []
+        self.lethal_count = 0       # probes skip the grid entirely when there is nothing that kills
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def add(self, trigger: Trigger):
+        volumes = [Volume(trigger, index) for index in range(trigger.volume_count)]
+        for volume in volumes:
+            self.grid.insert(volume)
+        self.triggers.append(trigger)
+        self.volumes[id(trigger)] = volumes
+        if trigger.moving:
+            self.moving.append(trigger)
+        if trigger.lethal:
+            self.lethal_count += 1
+
+    def remove(self, trigger: Trigger):
+        for volume in self.volumes.pop(id(trigger), []):
+            self.grid.remove(volume)
+        self.triggers.remove(trigger)
+        if trigger in self.moving:
+            self.moving.remove(trigger)
+        if trigger.lethal:
+            self.lethal_count -= 1
+
+    def clear(self):
+        self.grid.clear()
+        self.triggers = []
+        self.volumes = {}
+        self.moving = []
+        self.lethal_count = 0
+
+    def tick(self, dt: float):
+        # moves the moving triggers and re-indexes them
+        for trigger in self.moving:
+            trigger.tick(dt)
+            self.reindex(trigger)
+
+    def reindex(self, trigger: Trigger):
+        # updates where a trigger's volumes are indexed after it has moved
+        for volume in self.volumes[id(trigger)]:
+            self.grid.update(volume)
+
+    def overlapping(self, rect: pygame.rect.Rect) -> list[Volume]:
+        return [volume for volume in self.grid.query(rect) if rect.colliderect(volume.bounds)]
+
+    def triggers_in(self, rect: pygame.rect.Rect) -> list[Trigger]:
+        # the triggers with a volume overlapping rect, each one once and in the order they were added
+        return list({id(volume.trigger): volume.trigger for volume in self.overlapping(rect)}.values())
+
+    def lethal(self, rect: pygame.rect.Rect) -> bool:
+        # whether rect overlaps anything that kills
+        if not self.lethal_count:
+            return False
+        for volume in self.grid.query(rect):
+            if volume.trigger.lethal and rect.colliderect(volume.bounds):
+                return True
+        return False
+
+    def update(self, player):
+        """finds the volumes the player is in and sends the events, exits first then enters and stays in the order
+        the triggers were added
+        every volume is tested against where the player was before any of the events moved it"""
+        inside = player.triggers_inside
+        now = {id(volume): volume for volume in self.overlapping(player.rect)}
+        player.triggers_inside = now
+        for key, volume in inside.items():
+            if key not in now:
+                volume.trigger.on_exit(player, volume.index)
+        for key, volume in now.items():
+            if key in inside:
+                volume.trigger.on_stay(player, volume.index)
+            else:
+                volume.trigger.on_enter(player, volume.index)